@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+LOGGER = logging.getLogger(__name__)
+
+# Spotify audio features kept per track, column order of the vectors
+FEATURES = (
+    'key', 'mode', 'tempo', 'energy', 'valence', 'danceability', 'acousticness', 'instrumentalness',
+    'liveness', 'loudness', 'speechiness', 'time_signature', 'duration_ms'
+)
+STORE_DIR = os.environ.get(
+    'EUROVISION_AUDIO_FEATURES_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'eurovision_stat_audio')
+)
+IDS_FILE = 'ids.json'
+VECTORS_FILE = 'vectors.npy'
+
+_KEY = FEATURES.index('key')
+_store = None
+_store_lock = threading.Lock()
+
+
+class AudioFeatureStore(object):
+    """
+    Audio features of tracks as one contiguous float32 array, row i holds the FEATURES of ids[i].
+    Saved as ids.json and vectors.npy, who can be memory mapped on load
+    """
+
+    def __init__(self, ids=(), vectors=None):
+        # type: (list, np.ndarray) -> None
+        """
+        :param ids: Spotify track ids
+        :param vectors: float32 array shaped (tracks, FEATURES), None -> empty store
+        """
+        self.ids = list(ids)
+        self.vectors = np.zeros((0, len(FEATURES)), dtype=np.float32) if vectors is None else vectors
+        self._index = {track_id: i for i, track_id in enumerate(self.ids)}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, track_id):
+        return track_id in self._index
+
+    @staticmethod
+    def to_vector(features):
+        # type: (dict) -> list[float]
+        """
+        Spotify audio features dict to FEATURES row, missing features are 0, missing key is -1
+        :param features: audio features from Spotify API
+        :return: list of floats
+        """
+        return [float(features.get(name) if features.get(name) is not None else (-1 if name == 'key' else 0))
+                for name in FEATURES]
+
+    def add_many(self, audio_features):
+        # type: (iter) -> None
+        """
+        Add or replace tracks features, all rows are appended with one array copy
+        :param audio_features: iterable of audio features dicts from Spotify API, each with 'id'
+        :return: None
+        """
+        new_ids = []
+        new_rows = []
+        with self._lock:
+            for features in audio_features:
+                row = self.to_vector(features)
+                if features['id'] in self._index:
+                    if not self.vectors.flags.writeable:
+                        self.vectors = np.array(self.vectors)
+                    self.vectors[self._index[features['id']]] = row
+                elif features['id'] not in new_ids:
+                    new_ids.append(features['id'])
+                    new_rows.append(row)
+            if new_rows:
+                self._index.update((track_id, len(self.ids) + i) for i, track_id in enumerate(new_ids))
+                self.ids += new_ids
+                self.vectors = np.concatenate([self.vectors, np.asarray(new_rows, dtype=np.float32)])
+
+    def vector(self, track_id):
+        # type: (str) -> np.ndarray
+        return self.vectors[self._index[track_id]]
+
+    def rows(self, track_ids):
+        # type: (list) -> np.ndarray
+        """
+        Get vectors of tracks
+        :param track_ids: track ids in the store
+        :return: float32 array shaped (len(track_ids), FEATURES)
+        :raise: KeyError if a track is not in the store
+        """
+        return self.vectors[[self._index[track_id] for track_id in track_ids]]
+
+    def save(self, path=None):
+        # type: (str) -> None
+        """
+        Save store to directory
+        :param path: directory path, None -> STORE_DIR
+        :return: None
+        """
+        path = path or STORE_DIR
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            np.save(os.path.join(path, VECTORS_FILE), np.ascontiguousarray(self.vectors))
+            with open(os.path.join(path, IDS_FILE), 'w') as ids_file:
+                json.dump({'features': FEATURES, 'ids': self.ids}, ids_file)
+        LOGGER.info(f"Saved audio features. path: {path}, tracks: {len(self)}")
+
+    @classmethod
+    def load(cls, path=None, mmap=False):
+        # type: (str, bool) -> AudioFeatureStore
+        """
+        Load store saved with save
+        :param path: directory path, None -> STORE_DIR
+        :param mmap: True -> memory map the vectors read only, adding tracks copies them to memory
+        :return: AudioFeatureStore object, empty if nothing is saved or it was saved with other FEATURES
+        """
+        path = path or STORE_DIR
+        try:
+            with open(os.path.join(path, IDS_FILE)) as ids_file:
+                saved = json.load(ids_file)
+            vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode='r' if mmap else None)
+        except (OSError, ValueError):
+            return cls()
+        if tuple(saved['features']) != FEATURES:
+            LOGGER.warning(f"Saved audio features are outdated, start empty. path: {path}")
+            return cls()
+        return cls(saved['ids'], vectors)
+
+    @staticmethod
+    def _prepare(vectors, mean, std):
+        # type: (np.ndarray, np.ndarray, np.ndarray) -> np.ndarray
+        """
+        Scale vectors for cosine similarity - key as a point on the circle of fifths, other features standardized,
+        rows of unit length
+        """
+        key = vectors[:, _KEY]
+        angle = (key * 7 % 12) * (2 * np.pi / 12)
+        known = key >= 0
+        scaled = (np.delete(vectors, _KEY, axis=1) - mean) / std
+        prepared = np.column_stack([np.cos(angle) * known, np.sin(angle) * known, scaled]).astype(np.float32)
+        norms = np.linalg.norm(prepared, axis=1, keepdims=True)
+        return prepared / np.where(norms > 0, norms, 1)
+
+    def nearest_winners(self, candidates, k=5, winner_ids=None):
+        # type: (list or np.ndarray, int, list) -> list[list]
+        """
+        Find the past winners who sound the most like every candidate, all candidates in one matrix product
+        :param candidates: track ids in the store, or float array shaped (candidates, FEATURES) or (FEATURES,) of raw features
+        :param k: number of winners per candidate
+        :param winner_ids: track ids of the winners to compare with, None -> all tracks in the store
+        :return: list per candidate of [(winner id, cosine similarity)] pairs, most similar first.
+                 A candidate who is also a winner is not matched to itself
+        """
+        winner_ids = self.ids if winner_ids is None else list(winner_ids)
+        winners = self.rows(winner_ids)
+        if isinstance(candidates, np.ndarray):
+            candidate_vectors = candidates.astype(np.float32).reshape(-1, len(FEATURES))
+            candidate_ids = [None] * candidate_vectors.shape[0]
+        else:
+            candidate_ids = list(candidates)
+            candidate_vectors = self.rows(candidate_ids)
+        if not len(winner_ids) or not len(candidate_ids):
+            return [[] for _ in candidate_ids]
+        features = np.delete(winners, _KEY, axis=1)
+        mean = features.mean(axis=0)
+        std = features.std(axis=0)
+        std[std == 0] = 1
+        similarity = self._prepare(candidate_vectors, mean, std) @ self._prepare(winners, mean, std).T
+        winner_column = {track_id: i for i, track_id in enumerate(winner_ids)}
+        for row, track_id in enumerate(candidate_ids):
+            if track_id in winner_column:
+                similarity[row, winner_column[track_id]] = -np.inf
+        k = min(k, len(winner_ids))
+        top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(similarity, top, axis=1), axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        return [
+            [(winner_ids[column], float(similarity[row, column])) for column in top[row]
+             if np.isfinite(similarity[row, column])]
+            for row in range(len(candidate_ids))
+        ]
+
+
+def get_store():
+    # type: () -> AudioFeatureStore
+    """
+    Get the process wide store, loaded from STORE_DIR on first use
+    :return: AudioFeatureStore object
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = AudioFeatureStore.load()
+            LOGGER.info(f"Loaded audio features. tracks: {len(_store)}")
+        return _store
+
+
+def set_store(store):
+    # type: (AudioFeatureStore) -> None
+    """
+    Replace the process wide store, None -> load again on next use
+    :param store: AudioFeatureStore object or None
+    :return: None
+    """
+    global _store
+    with _store_lock:
+        _store = store
@@ -0,0 +1,154 @@
+"""
+Synthetic eschome, wikipedia and Spotify fixtures shaped like the real responses, scalable to any size.
+All fixtures are deterministic, so runs on different commits parse the same data
+"""
+import random
+
+POINTS = (12, 10, 8, 7, 6, 5, 4, 3, 2, 1)
+GENRES = ('pop', 'dance pop', 'europop', 'classic rock', 'classical', 'schlager', 'folk')
+
+
+def country_names(count):
+    # type: (int) -> list[str]
+    return [f'Country {i}' for i in range(count)]
+
+
+def make_countries_page(count):
+    # type: (int) -> bytes
+    """
+    eschome main page with the countries select
+    :param count: number of countries
+    :return: html content
+    """
+    options = ''.join(f'<option value="c{i}">{name}</option>' for i, name in enumerate(country_names(count)))
+    navigation = ''.join(f'<li><a href="/page{i}.php">Page {i}</a></li>' for i in range(200))
+    return (
+        f'<html><body><ul>{navigation}</ul>'
+        f'<form><select id="nosubmit" name="country_x">{options}</select></form></body></html>'
+    ).encode('utf-8')
+
+
+def make_votes_rows(country, countries, year_from, year_to, from_country=True):
+    # type: (int, int, int, int, bool) -> list[tuple]
+    """
+    Votes of one country over a range of years
+    :param country: country index
+    :param countries: number of countries
+    :param year_from: first year
+    :param year_to: last year
+    :param from_country: True -> votes given by country, False -> votes given to country
+    :return: list of (year, other country name, points) tuples
+    """
+    names = country_names(countries)
+    rows = []
+    for year in range(year_from, year_to + 1):
+        rng = random.Random(f'{country}-{year}-{from_country}')
+        others = rng.sample([i for i in range(countries) if i != country], min(len(POINTS), countries - 1))
+        rows += [(year, names[other], points) for other, points in zip(others, POINTS)]
+    return rows
+
+
+def make_votes_page(rows=None, country=0, countries=50, year_from=1956, year_to=2018, from_country=True):
+    # type: (list, int, int, int, int, bool) -> bytes
+    """
+    eschome votes output page - navigation, forms and table#tabelle1 with year, country and points columns
+    :param rows: list of (year, country name, points) tuples, None -> generate with make_votes_rows
+    :return: html content
+    """
+    if rows is None:
+        rows = make_votes_rows(country, countries, year_from, year_to, from_country)
+    navigation = ''.join(f'<li><a href="/page{i}.php">Page {i}</a></li>' for i in range(200))
+    options = ''.join(f'<option value="c{i}">{name}</option>' for i, name in enumerate(country_names(60)))
+    votes = ''.join(f'<tr><td>{year}</td><td>{name}</td><td>{points}</td></tr>' for year, name, points in rows)
+    return (
+        f'<html><head><title>votes</title></head><body><ul>{navigation}</ul>'
+        f'<form><select id="nosubmit" name="country_x">{options}</select></form>'
+        f'<table id="tabelle1"><tr><th>Year</th><th>Country</th><th>Points</th></tr>{votes}</table>'
+        f'<div>{navigation}</div></body></html>'
+    ).encode('utf-8')
+
+
+def make_winners_page(years):
+    # type: (int) -> bytes
+    """
+    wikipedia list of winners page with winners by year, by country and by language wikitables
+    :param years: number of contest years
+    :return: html content
+    """
+    by_year = ''.join(
+        f'<tr><th><a href="/y{i}">{1956 + i}</a></th><td>{i % 28 + 1} May</td><td><a href="/h{i}">City {i}</a></td>'
+        f'<td><a href="/c{i}">Country {i % 40}</a></td><td><a href="/s{i}">Song {i}</a></td>'
+        f'<td><a href="/p{i}">Performer {i}</a></td></tr>'
+        for i in range(years)
+    )
+    by_country = ''.join(
+        f'<tr><td>{len(range(c, years, 40))}</td><td>Country {c}</td>'
+        f'<td>{", ".join(f"<a href=/y{y}>{1956 + y}</a>" for y in range(c, years, 40))}</td></tr>'
+        for c in range(min(40, years))
+    )
+    by_lang = ''.join(
+        f'<tr><td>{len(range(l, years, 12))}</td><td><a href="/l{l}">Language {l}</a></td>'
+        f'<td>{", ".join(f"<a href=/y{y}>{1956 + y}</a>" for y in range(l, years, 12))}</td>'
+        f'<td>{", ".join(f"<a href=/c{y % 40}>Country {y % 40}</a>" for y in range(l, years, 12))}</td></tr>'
+        for l in range(min(12, years))
+    )
+    header = '<tr><th>a</th><th>b</th><th>c</th><th>d</th></tr>'
+    tables = [by_year, by_country, '', '', by_lang]
+    content = ''.join(f'<table class="wikitable">{header}{rows}</table><p>text</p>' for rows in tables)
+    return f'<html><body><div>{"<p>paragraph</p>" * 500}</div>{content}</body></html>'.encode('utf-8')
+
+
+def make_playlist_items(count):
+    # type: (int) -> list[dict]
+    """
+    Spotify playlist items
+    :param count: number of tracks
+    :return: list of playlist items
+    """
+    return [
+        {'track': {
+            'name': f'Song {i}',
+            'id': f'track{i}',
+            'artists': [{'id': f'artist{i % max(1, count // 3)}', 'name': f'Artist {i % max(1, count // 3)}'}],
+            'album': {'release_date': f'{1956 + i % 63}-05-01'}
+        }}
+        for i in range(count)
+    ]
+
+
+class StubSpotify(object):
+    """
+    Offline stand in for spotipy.Spotify, serves a playlist of generated tracks page by page
+    """
+
+    def __init__(self, tracks):
+        # type: (int) -> None
+        self.items = make_playlist_items(tracks)
+        self.calls = 0
+
+    def _page(self, offset, limit):
+        self.calls += 1
+        has_next = offset + limit < len(self.items)
+        return {
+            'items': self.items[offset:offset + limit],
+            'offset': offset,
+            'limit': limit,
+            'total': len(self.items),
+            'next': f'stub://playlist?offset={offset + limit}' if has_next else None
+        }
+
+    def user_playlist_tracks(self, user, playlist_id, limit=100):
+        return self._page(0, limit)
+
+    def next(self, page):
+        return self._page(page['offset'] + page['limit'], page['limit'])
+
+    def artists(self, ids):
+        self.calls += 1
+        return {'artists': [{'id': i, 'genres': [GENRES[sum(map(ord, i)) % len(GENRES)]]} for i in ids]}
+
+    def audio_features(self, ids):
+        self.calls += 1
+        return [{'id': i, 'key': int(i[5:]) % 12, 'mode': int(i[5:]) % 2, 'tempo': 90.0 + int(i[5:]) % 70,
+                 'energy': int(i[5:]) % 10 / 10, 'valence': int(i[5:]) % 7 / 7, 'danceability': int(i[5:]) % 5 / 5,
+                 'duration_ms': 180000 + int(i[5:]) % 60 * 1000} for i in ids]
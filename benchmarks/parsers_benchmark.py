@@ -0,0 +1,42 @@
+"""
+Micro benchmark for parsing a single votes page (table#tabelle1).
+Compares the original full page html.parser parse with every available parsers backend.
+Run: python -m EurovisionStat.winning_eurovision_2019.benchmarks.parsers_benchmark
+"""
+import timeit
+
+from bs4 import BeautifulSoup
+from EurovisionStat.winning_eurovision_2019 import parsers
+from EurovisionStat.winning_eurovision_2019.benchmarks.fixtures import make_votes_page, make_votes_rows
+
+ROWS = 60
+REPEAT = 200
+
+
+def parse_full_page(content):
+    # type: (bytes) -> list
+    """
+    Votes parse as done before the parsers layer - full html.parser parse, find_all('td') twice per row
+    """
+    table = BeautifulSoup(content, 'html.parser').find("table", {"id": "tabelle1"})
+    rows = []
+    for row in table.find_all("tr"):
+        try:
+            rows.append((row.find_all('td')[1].text, row.find_all('td')[2].text))
+        except IndexError:
+            pass
+    return rows
+
+
+def main():
+    content = make_votes_page(rows=make_votes_rows(0, 50, 1956, 1956 + ROWS // 10 - 1))
+    baseline = timeit.timeit(lambda: parse_full_page(content), number=REPEAT) / REPEAT
+    print(f"{'full page html.parser':<24}{baseline * 1000:8.3f} ms/page")
+    for backend in parsers.available_backends():
+        parsers.set_backend(backend)
+        per_page = timeit.timeit(lambda: parsers.table_rows(content, 'tabelle1'), number=REPEAT) / REPEAT
+        print(f"{backend:<24}{per_page * 1000:8.3f} ms/page  x{baseline / per_page:.1f}")
+
+
+if __name__ == '__main__':
+    main()
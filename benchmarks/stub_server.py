@@ -0,0 +1,80 @@
+"""
+Local HTTP server who replays eschome and wikipedia fixtures, so scrapers run without network
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from EurovisionStat.winning_eurovision_2019.benchmarks import fixtures
+
+WINNERS_PATH = '/wiki/List_of_Eurovision_Song_Contest_winners'
+
+
+class StubServer(object):
+    """
+    GET / -> countries page, GET WINNERS_PATH -> winners page, POST any path -> votes page of the posted form
+    """
+
+    def __init__(self, countries, winner_years=63):
+        # type: (int, int) -> None
+        self.countries = countries
+        self.countries_page = fixtures.make_countries_page(countries)
+        self.winners_page = fixtures.make_winners_page(winner_years)
+        self.requests = 0
+        self.bytes = 0
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        # type: () -> str
+        return f'http://127.0.0.1:{self._server.server_address[1]}/'
+
+    def votes_page(self, form):
+        # type: (dict) -> bytes
+        country = int(form['country_x'][0].lstrip('c'))
+        return fixtures.make_votes_page(
+            country=country,
+            countries=self.countries,
+            year_from=int(form['year_from'][0]),
+            year_to=int(form['year_to'][0]),
+            from_country=form['direction'][0] == '1'
+        )
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send(self, body):
+                stub.requests += 1
+                stub.bytes += len(body)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._send(stub.winners_page if self.path.startswith(WINNERS_PATH) else stub.countries_page)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                form = parse_qs(self.rfile.read(length).decode('utf-8'))
+                self._send(stub.votes_page(form))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,184 @@
+"""
+Offline end to end benchmark suite.
+Scrapers run against a local stub HTTP server and a stub Spotify client, data is stored in mongomock
+(or a local mongod with --mongo-uri, its eurovision db is overwritten).
+Every workload runs at 1x, 10x and 100x synthetic data sizes (1x and 10x on mongomock, its upserts are slow),
+results are saved under benchmarks/results
+Run: python -m EurovisionStat.winning_eurovision_2019.benchmarks.suite [--scales 1,10] [--compare RESULT.json]
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+from pymongo import MongoClient
+from EurovisionStat.winning_eurovision_2019 import (
+    audio_features, countries, http_cache, metrics, mongo, page_spool, parsers, song_winners, spotify_cache, spotify_songs, votes
+)
+from EurovisionStat.winning_eurovision_2019.benchmarks import fixtures
+from EurovisionStat.winning_eurovision_2019.benchmarks.stub_server import StubServer, WINNERS_PATH
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+SCALES = (1, 10, 100)
+MONGOMOCK_SCALES = (1, 10)
+FUNCTIONS = (
+    'parse_by_year', 'parse_by_country', 'parse_by_lang', 'get_all_votes', 'parse_songs', 'calc_best_friends',
+    'table_rows', 'mongo.bulk_write', 'http.request'
+)
+
+# 1x sizes
+WINNER_YEARS = 63
+VOTES_PAGES = 10
+VOTES_COUNTRIES = 10
+TRACKS = 100
+# Tracks scored against all the others in nearest_winners
+CANDIDATES = 40
+
+
+def _new_client(mongo_uri):
+    # type: (str) -> MongoClient
+    if mongo_uri:
+        client = MongoClient(mongo_uri)
+        client.drop_database('eurovision')
+        return client
+    import mongomock
+    return mongomock.MongoClient()
+
+
+def _timed(function, *args, **kwargs):
+    # type: (callable) -> tuple
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def run_scale(scale, mongo_uri=None):
+    # type: (int, str) -> dict
+    """
+    Run all workloads at one data size
+    :param scale: data size multiplier
+    :param mongo_uri: local mongod uri, None -> mongomock
+    :return: dict with workloads throughput and per function timings
+    """
+    metrics.reset()
+    mongo.set_client(_new_client(mongo_uri))
+    countries.set_registry(None)
+    country_count = VOTES_COUNTRIES * scale
+    workloads = {}
+    with StubServer(countries=country_count, winner_years=WINNER_YEARS * scale) as server:
+        votes.EUROVISION_DB_URL = server.url
+
+        node, seconds = _timed(song_winners.download_html, server.url + WINNERS_PATH)
+        _, parse_seconds = _timed(song_winners.parse_winner_tables, node)
+        workloads['winner_tables'] = {'seconds': seconds + parse_seconds, 'rows': WINNER_YEARS * scale}
+
+        pages = VOTES_PAGES * scale
+        _, seconds = _timed(lambda: [votes.get_all_votes(f'c{i % country_count}', from_country=True, year_from=1956,
+                                                         year_to=2018, by_year=True) for i in range(pages)])
+        workloads['get_all_votes'] = {'seconds': seconds, 'pages_per_second': pages / seconds}
+
+        requests_before = server.requests
+        _, seconds = _timed(votes.workflow, concurrency=8)
+        documents = country_count * 2 * (votes.LAST_YEAR - votes.FIRST_YEAR + 1)
+        workloads['votes_workflow'] = {
+            'seconds': seconds,
+            'pages_per_second': (server.requests - requests_before) / seconds,
+            'docs_per_second': documents / seconds
+        }
+    _, seconds = _timed(votes.calc_best_friends)
+    workloads['calc_best_friends'] = {'seconds': seconds, 'countries': country_count}
+
+    tracks = TRACKS * scale
+    spotify_songs.set_spotify(fixtures.StubSpotify(tracks))
+    audio_features.set_store(audio_features.AudioFeatureStore())
+    stored, seconds = _timed(spotify_songs.workflow)
+    workloads['spotify_workflow'] = {'seconds': seconds, 'tracks_per_second': tracks / seconds,
+                                     'docs_per_second': stored / seconds}
+    candidates = [f'track{i}' for i in range(0, tracks, max(1, tracks // CANDIDATES))]
+    _, seconds = _timed(audio_features.get_store().nearest_winners, candidates, 5)
+    workloads['nearest_winners'] = {'seconds': seconds, 'candidates': len(candidates), 'winners': tracks}
+
+    snapshot = metrics.snapshot()
+    functions = {
+        name: {key: snapshot[name][key] for key in ('calls', 'seconds', 'mean_seconds')}
+        for name in FUNCTIONS if name in snapshot
+    }
+    return {'workloads': workloads, 'functions': functions}
+
+
+def _commit():
+    # type: () -> str
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(current, previous):
+    # type: (dict, dict) -> None
+    """
+    Print timing ratio of every workload and function between two results, > 1 -> current is slower
+    :param current: result of this run
+    :param previous: result loaded from file
+    :return: None
+    """
+    print(f"\nCompare {current['commit']} to {previous['commit']} (ratio > 1 -> slower)")
+    for scale, result in current['scales'].items():
+        old = previous['scales'].get(scale)
+        if old is None:
+            continue
+        for group, key in (('workloads', 'seconds'), ('functions', 'mean_seconds')):
+            for name, values in result[group].items():
+                old_value = old[group].get(name, {}).get(key)
+                if old_value:
+                    print(f"{scale:<6}{name:<24}{values[key] / old_value:8.2f}")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark suite')
+    parser.add_argument('--scales', help='comma separated data size multipliers, default: 1,10,100 (1,10 on mongomock)')
+    parser.add_argument('--mongo-uri', help='local mongod uri, default: mongomock')
+    parser.add_argument('--output', help='result file, default: benchmarks/results/<time>-<commit>.json')
+    parser.add_argument('--compare', metavar='RESULT', help='previous result file to compare to')
+    arguments = parser.parse_args(args)
+    logging.getLogger('EurovisionStat').setLevel(logging.WARNING)
+    http_cache.configure(enabled=False)
+    spotify_cache.configure(enabled=False)
+    page_spool.configure(directory=tempfile.mkdtemp(prefix='eurovision_pages_'))
+    audio_features.STORE_DIR = tempfile.mkdtemp(prefix='eurovision_audio_')
+
+    result = {
+        'commit': _commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'parser_backend': parsers.BACKEND,
+        'scales': {}
+    }
+    if arguments.scales:
+        scales = [int(scale) for scale in arguments.scales.split(',')]
+    else:
+        scales = SCALES if arguments.mongo_uri else MONGOMOCK_SCALES
+    for scale in scales:
+        print(f"Running {scale}x")
+        result['scales'][f'{scale}x'] = run_scale(scale, arguments.mongo_uri)
+        for name, values in result['scales'][f'{scale}x']['workloads'].items():
+            print(f"  {name:<22}" + '  '.join(f"{key}: {value:.4g}" for key, value in values.items()))
+    output = arguments.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{result['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as result_file:
+        json.dump(result, result_file, indent=4)
+    print(f"Saved result: {output}")
+    if arguments.compare:
+        with open(arguments.compare) as previous_file:
+            compare(result, json.load(previous_file))
+
+
+if __name__ == '__main__':
+    main()
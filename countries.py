@@ -0,0 +1,183 @@
+import logging
+import re
+import threading
+import unicodedata
+
+from EurovisionStat.winning_eurovision_2019.mongo import get_client
+
+LOGGER = logging.getLogger(__name__)
+
+COLLECTION = 'countries'
+
+# Names who mean the same contest participant, as normalized keys. First key is the canonical one
+ALIASES = (
+    ('unitedkingdom', 'uk', 'greatbritain'),
+    ('netherlands', 'thenetherlands', 'holland'),
+    ('northmacedonia', 'macedonia', 'fyrmacedonia', 'fyromacedonia', 'formeryugoslavrepublicofmacedonia'),
+    ('czechrepublic', 'czechia'),
+    ('russia', 'russianfederation'),
+    ('bosniaherzegovina', 'bosniaandherzegovina'),
+    ('serbiamontenegro', 'serbiaandmontenegro'),
+    ('moldova', 'republicofmoldova'),
+    ('germany', 'westgermany')
+)
+
+_NOT_ALPHANUMERIC = re.compile(r'[^a-z0-9]')
+_CANONICAL = {alias: aliases[0] for aliases in ALIASES for alias in aliases}
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+class UnknownCountryError(KeyError):
+    """
+    Raised in strict lookups of a name who is not a registered country or alias
+    """
+
+
+def normalize(name):
+    # type: (str) -> str
+    """
+    Normalize country name - lower case, without accents, spaces and punctuation, known aliases to canonical key.
+    e.g. "Bosnia & Herzegovina", "BosniaandHerzegovina" -> "bosniaherzegovina"
+    :param name: country name
+    :return: canonical key
+    """
+    decomposed = unicodedata.normalize('NFKD', name)
+    without_accents = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    key = _NOT_ALPHANUMERIC.sub('', without_accents.lower())
+    return _CANONICAL.get(key, key)
+
+
+class CountryRegistry(object):
+    """
+    Interns every country to a small integer id. Names, wikipedia names and eschome codes are aliases of the id.
+    Registered countries are kept in the countries collection: {'_id': id, 'name', 'code', 'aliases'}
+    """
+
+    def __init__(self, collection=None):
+        """
+        :param collection: Mongo countries collection, None -> in memory only
+        """
+        self.collection = collection
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._names = {}
+        self._codes = {}
+        self._unknown = set()
+        if collection is not None:
+            for doc in collection.find():
+                self._add(doc['_id'], doc['name'], doc.get('code'), doc.get('aliases', []))
+        LOGGER.info(f"Loaded countries registry. countries: {len(self._names)}")
+
+    def __len__(self):
+        return len(self._names)
+
+    def _add(self, country_id, name, code=None, aliases=()):
+        self._names[country_id] = name
+        if code:
+            self._codes[code.lower()] = country_id
+        for alias in (name, *aliases):
+            self._ids.setdefault(normalize(alias), country_id)
+
+    def register(self, name, code=None):
+        # type: (str, str) -> int
+        """
+        Get id of a country, register it when it is new. Used with the authoritative eschome countries list
+        :param name: country name
+        :param code: eschome country code
+        :return: country id
+        """
+        with self._lock:
+            country_id = self._ids.get(normalize(name))
+            if country_id is None:
+                country_id = len(self._names) + 1
+                LOGGER.info(f"Register country. id: {country_id}, name: {name}, code: {code}")
+                self._add(country_id, name, code)
+                if self.collection is not None:
+                    self.collection.insert_one({'_id': country_id, 'name': name, 'code': code, 'aliases': []})
+            elif code and code.lower() not in self._codes:
+                self._codes[code.lower()] = country_id
+                if self.collection is not None:
+                    self.collection.update_one({'_id': country_id}, {'$set': {'code': code}})
+            return country_id
+
+    def add_alias(self, alias, country_id):
+        # type: (str, int) -> None
+        """
+        Make alias name point to a registered country
+        :param alias: another name of the country
+        :param country_id: registered country id
+        :return: None
+        """
+        with self._lock:
+            self._ids[normalize(alias)] = country_id
+            if self.collection is not None:
+                self.collection.update_one({'_id': country_id}, {'$addToSet': {'aliases': alias}})
+
+    def lookup(self, name, strict=False):
+        # type: (str, bool) -> int
+        """
+        Get id of a registered country by any of its names. Unknown names are logged, so mismatches show at ingest
+        :param name: country name or alias
+        :param strict: True -> raise instead of returning None
+        :return: country id, None if the name is unknown
+        :raise: UnknownCountryError in strict mode if the name is unknown
+        """
+        key = normalize(name)
+        country_id = self._ids.get(key)
+        if country_id is None:
+            if strict:
+                raise UnknownCountryError(name)
+            if key not in self._unknown:
+                self._unknown.add(key)
+                LOGGER.warning(f"Unknown country name: {name}")
+        return country_id
+
+    def by_code(self, code):
+        # type: (str) -> int
+        """
+        Get id of a country by its eschome code
+        :param code: eschome country code
+        :return: country id, None if the code is unknown
+        """
+        return self._codes.get(code.lower())
+
+    def name(self, country_id):
+        # type: (int) -> str
+        return self._names[country_id]
+
+    def canonical_name(self, name):
+        # type: (str) -> str
+        """
+        Get registered name of a country by any of its names, e.g. "Country1" -> "Country 1"
+        :param name: country name or alias
+        :return: registered name, the given name if it is unknown
+        """
+        country_id = self.lookup(name)
+        return name if country_id is None else self._names[country_id]
+
+
+def get_registry():
+    # type: () -> CountryRegistry
+    """
+    Get the process wide registry, loaded from the countries collection on first use
+    :return: CountryRegistry object
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = CountryRegistry(get_client().eurovision[COLLECTION])
+        return _registry
+
+
+def set_registry(registry):
+    # type: (CountryRegistry) -> None
+    """
+    Replace the process wide registry, None -> load again on next use
+    :param registry: CountryRegistry object or None
+    :return: None
+    """
+    global _registry
+    with _registry_lock:
+        _registry = registry
@@ -0,0 +1,181 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get('EUROVISION_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'eurovision_stat'))
+ENABLED = True
+OFFLINE = False
+# Seconds until cached response is stale, None -> never
+TTL = 30 * 24 * 60 * 60
+MAX_SIZE = 512 * 1024 * 1024
+
+_lock = threading.Lock()
+_total_size = None
+
+
+class CacheMissError(Exception):
+    """
+    Raised in offline mode when the requested response is not in the cache
+    """
+
+
+def configure(directory=None, enabled=None, offline=None, ttl=-1, max_size=None):
+    # type: (str, bool, bool, int, int) -> None
+    """
+    Change cache settings, arguments left out keep their current value
+    :param directory: cache directory
+    :param enabled: False -> never read or write the cache
+    :param offline: True -> serve only from cache, raise CacheMissError on miss
+    :param ttl: seconds until cached response is stale, None -> never
+    :param max_size: max cache size in bytes, least recently used responses are evicted above it
+    :return: None
+    """
+    global CACHE_DIR, ENABLED, OFFLINE, TTL, MAX_SIZE, _total_size
+    with _lock:
+        if directory is not None:
+            CACHE_DIR = directory
+            _total_size = None
+        if enabled is not None:
+            ENABLED = enabled
+        if offline is not None:
+            OFFLINE = offline
+        if ttl != -1:
+            TTL = ttl
+        if max_size is not None:
+            MAX_SIZE = max_size
+
+
+def make_key(method, url, data=None):
+    # type: (str, str, dict) -> str
+    """
+    Build cache key from request method, url and payload
+    :param method: HTTP method
+    :param url: request url
+    :param data: form payload
+    :return: hex digest who identify the request
+    """
+    payload = sorted((str(k), str(v)) for k, v in (data or {}).items())
+    raw = json.dumps([method.upper(), url, payload])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _path(key):
+    # type: (str) -> str
+    return os.path.join(CACHE_DIR, key[:2], key)
+
+
+def load(key, ttl=-1):
+    # type: (str, int) -> bytes
+    """
+    Get cached response body
+    :param key: cache key from make_key
+    :param ttl: seconds until cached response is stale, -1 -> use TTL, None -> never
+    :return: response body, None if not cached or stale
+    """
+    if not ENABLED:
+        return None
+    if ttl == -1:
+        ttl = TTL
+    path = _path(key)
+    try:
+        with open(path, 'rb') as cached:
+            meta = json.loads(cached.readline())
+            body = gzip.decompress(cached.read())
+    except (OSError, ValueError):
+        return None
+    if ttl is not None and not OFFLINE and time.time() - meta['stored'] > ttl:
+        LOGGER.debug(f"Stale cache entry. url: {meta['url']}")
+        return None
+    # Touch the file, eviction removes the least recently used entries first
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return body
+
+
+def store(key, url, body):
+    # type: (str, str, bytes) -> None
+    """
+    Save compressed response body and evict old entries if cache is over MAX_SIZE
+    :param key: cache key from make_key
+    :param url: request url, kept for debugging
+    :param body: response body
+    :return: None
+    """
+    global _total_size
+    if not ENABLED:
+        return
+    path = _path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    meta = json.dumps({'url': url, 'stored': time.time()}).encode('utf-8')
+    content = meta + b'\n' + gzip.compress(body)
+    tmp_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as cached:
+        cached.write(content)
+    with _lock:
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        if _total_size is None:
+            _total_size = sum(size for _, size, _ in _entries())
+        else:
+            _total_size += len(content) - old_size
+        if _total_size > MAX_SIZE:
+            _evict()
+
+
+def _entries():
+    # type: () -> list[tuple]
+    """
+    List cached files
+    :return: list of (path, size, last used time) tuples
+    """
+    entries = []
+    if not os.path.isdir(CACHE_DIR):
+        return entries
+    for sub_dir in os.scandir(CACHE_DIR):
+        if not sub_dir.is_dir():
+            continue
+        for entry in os.scandir(sub_dir.path):
+            if entry.name.endswith('.tmp'):
+                continue
+            stat = entry.stat()
+            entries.append((entry.path, stat.st_size, stat.st_mtime))
+    return entries
+
+
+def _evict():
+    """
+    Remove least recently used entries until cache size is under MAX_SIZE. Called with _lock held
+    :return: None
+    """
+    global _total_size
+    entries = sorted(_entries(), key=lambda entry: entry[2])
+    _total_size = sum(size for _, size, _ in entries)
+    for path, size, _ in entries:
+        if _total_size <= MAX_SIZE:
+            break
+        try:
+            os.remove(path)
+            _total_size -= size
+        except OSError:
+            pass
+    LOGGER.info(f"Evicted cache entries. cache size: {_total_size}")
+
+
+def clear():
+    """
+    Remove all cached responses
+    :return: None
+    """
+    global _total_size
+    with _lock:
+        for path, _, _ in _entries():
+            os.remove(path)
+        _total_size = 0
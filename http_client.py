@@ -0,0 +1,268 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from EurovisionStat.winning_eurovision_2019 import http_cache, metrics
+
+LOGGER = logging.getLogger(__name__)
+
+POOL_SIZE = 16
+# (connect, read) timeouts in seconds
+TIMEOUT = (10, 60)
+MAX_RETRIES = 5
+# Retry n waits a random time between 0 and min(BACKOFF_MAX, BACKOFF_BASE * 2 ** n) seconds
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+# Longest Retry-After honored, longer waits are capped
+RETRY_AFTER_MAX = 120.0
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+_session = None
+_session_lock = threading.Lock()
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class InvalidResponseError(requests.RequestException):
+    """
+    Raised when the response body is still invalid (e.g. a throttle page) after the last retry
+    """
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket limiter of a single host - up to burst requests at once, refilled at rate per second.
+    The host can be paused, for example when it asks to retry after some time
+    """
+
+    def __init__(self, rate=None, burst=1):
+        # type: (float, int) -> None
+        """
+        :param rate: tokens added per second, None -> no limit, only pauses are applied
+        :param burst: bucket capacity
+        """
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def wait(self):
+        """
+        Block the calling thread until it is allowed to send the next request
+        :return: None
+        """
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._paused_until - now)
+            if self.rate:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                # Take the token now, a negative balance is the debt waiting callers pay back in order
+                self._tokens -= 1
+                if self._tokens < 0:
+                    delay = max(delay, -self._tokens / self.rate)
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        # type: (float) -> None
+        """
+        Hold all requests to the host for the given time
+        :param seconds: pause length
+        :return: None
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def get_session():
+    # type: () -> requests.Session
+    """
+    Get the process wide HTTP session, create it on first use.
+    The session keeps up to POOL_SIZE open connections per host, so it can be shared between worker threads
+    :return: requests.Session object
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            LOGGER.info(f"Create pooled HTTP session. pool size: {POOL_SIZE}")
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def set_pool_size(pool_size):
+    # type: (int) -> None
+    """
+    Change the connection pool size. Takes effect on the next session created
+    :param pool_size: max open connections per host
+    :return: None
+    """
+    global POOL_SIZE, _session
+    with _session_lock:
+        if pool_size != POOL_SIZE and _session is not None:
+            _session.close()
+            _session = None
+        POOL_SIZE = pool_size
+
+
+def set_rate_limit(url, max_per_second, burst=1):
+    # type: (str, float, int) -> None
+    """
+    Cap the request rate to the host of the given url
+    :param url: any url on the wanted host
+    :param max_per_second: max requests per second, None removes the cap
+    :param burst: max requests sent at once before the rate applies
+    :return: None
+    """
+    with _limiters_lock:
+        _limiters[urlparse(url).netloc] = TokenBucket(max_per_second or None, burst)
+
+
+def _limiter(url):
+    # type: (str) -> TokenBucket
+    host = urlparse(url).netloc
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = _limiters[host] = TokenBucket()
+        return limiter
+
+
+def backoff(attempt):
+    # type: (int) -> float
+    """
+    Jittered exponential backoff delay
+    :param attempt: number of the retry, starting at 0
+    :return: seconds to wait
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_after(response):
+    # type: (requests.Response) -> float
+    """
+    Get the wait time the server asked for in the Retry-After header
+    :param response: throttled response
+    :return: seconds to wait, None if the header is missing or invalid
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), RETRY_AFTER_MAX)
+
+
+def _send(method, url, data, headers, is_valid):
+    # type: (str, str, dict, dict, callable) -> requests.Response
+    """
+    Send request, retry connection errors, timeouts, 429 and 5xx responses and invalid bodies with backoff
+    :return: successful response
+    :raise: requests.RequestException if the last attempt failed to connect or timed out,
+            requests.HTTPError if the last response is 429 or 5xx,
+            InvalidResponseError if the last response body is invalid
+    """
+    limiter = _limiter(url)
+    for attempt in range(MAX_RETRIES + 1):
+        limiter.wait()
+        try:
+            with metrics.timer('http.request'):
+                response = get_session().request(method, url, data=data, headers=headers, timeout=TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = backoff(attempt)
+            LOGGER.warning(f"Request failed, retry in {delay:.1f}s. url: {url}, error: {e!r}")
+        else:
+            metrics.add_bytes('http.request', len(response.content))
+            if response.status_code in RETRY_STATUSES:
+                reason = f"status: {response.status_code}"
+            elif response.ok and is_valid is not None and not is_valid(response.content):
+                # Throttled pages come back as 200 without the wanted content
+                reason = 'invalid body'
+            else:
+                return response
+            if attempt == MAX_RETRIES:
+                LOGGER.error(f"Giving up after {MAX_RETRIES} retries. url: {url}, {reason}")
+                response.raise_for_status()
+                raise InvalidResponseError(f"Invalid response body. url: {url}", response=response)
+            delay = retry_after(response)
+            if delay is None:
+                delay = backoff(attempt)
+            else:
+                # Server asked all clients to hold off, not only this thread
+                limiter.pause(delay)
+            LOGGER.warning(f"Request throttled, retry in {delay:.1f}s. url: {url}, {reason}")
+        metrics.add_retry('http.request')
+        time.sleep(delay)
+
+
+def _fetch(method, url, data=None, headers=None, ttl=-1, is_valid=None):
+    # type: (str, str, dict, dict, int, callable) -> bytes
+    """
+    Send request through the shared session, respecting the host rate limit and retrying transient failures.
+    Response is served from the on disk cache when possible, and successful responses are stored in it
+    :param method: HTTP method
+    :param url: request url
+    :param data: form payload
+    :param headers: request headers
+    :param ttl: seconds until cached response is stale, -1 -> cache default, None -> never
+    :param is_valid: callable who gets the response body and returns False if the response should be retried
+    :return: response body
+    :raise: http_cache.CacheMissError if cache is offline and the response is not cached,
+            requests.RequestException if the request still fails after all retries (see _send)
+    """
+    key = http_cache.make_key(method, url, data)
+    body = http_cache.load(key, ttl)
+    if body is not None:
+        LOGGER.debug(f"Serve response from cache. url: {url}")
+        metrics.observe('http.cache_hit', 0.0)
+        metrics.add_bytes('http.cache_hit', len(body))
+        return body
+    if http_cache.OFFLINE:
+        raise http_cache.CacheMissError(f"{method} {url} {data}")
+    response = _send(method, url, data, headers, is_valid)
+    if response.ok and (is_valid is None or is_valid(response.content)):
+        http_cache.store(key, url, response.content)
+    return response.content
+
+
+def get(url, ttl=-1, is_valid=None):
+    # type: (str, int, callable) -> bytes
+    """
+    Send GET request, see _fetch
+    :param url: request url
+    :param ttl: seconds until cached response is stale, -1 -> cache default, None -> never
+    :param is_valid: callable who gets the response body and returns False if the response should be retried
+    :return: response body
+    """
+    return _fetch('GET', url, ttl=ttl, is_valid=is_valid)
+
+
+def post(url, data=None, headers=None, ttl=-1, is_valid=None):
+    # type: (str, dict, dict, int, callable) -> bytes
+    """
+    Send POST request, see _fetch
+    :param url: request url
+    :param data: form payload
+    :param headers: request headers
+    :param ttl: seconds until cached response is stale, -1 -> cache default, None -> never
+    :param is_valid: callable who gets the response body and returns False if the response should be retried
+    :return: response body
+    """
+    return _fetch('POST', url, data=data, headers=headers, ttl=ttl, is_valid=is_valid)
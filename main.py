@@ -1,5 +1,7 @@
+import argparse
 import logging
-from EurovisionStat.winning_eurovision_2019 import song_winners, spotify_songs, votes
+from functools import partial
+from EurovisionStat.winning_eurovision_2019 import metrics, mongo, schema, song_winners, spotify_songs, tasks, votes
 
 
 def _setup_logging():
@@ -21,20 +23,100 @@ def _setup_logging():
     logger.addHandler(ch)
 
 
-def main():
+def build_tasks(incremental=False, votes_options=None):
+    # type: (bool, dict) -> dict
     """
-    Setup global logger for logging progress
+    Build the workflows task graph
+    countries registers the eschome countries, so wikipedia names are matched to their ids.
+    Downloads (winner tables, spotify songs, votes) don't depend on each other and run in parallel,
+    each statistic starts as soon as the data it reads is stored
+    :param incremental: True -> download only data who is not stored yet or marked stale
+    :param votes_options: keyword arguments of votes.workflow, e.g. concurrency, parse_workers, max_requests_per_second
+    :return: dict: key: task name, value: tasks.Task
+    """
+    graph = [
+        tasks.Task('countries', votes.create_country_flag_collection),
+        tasks.Task('winner_tables', partial(song_winners.update_winner_tables, incremental=incremental),
+                   requires=('countries',)),
+        tasks.Task('spotify_songs', partial(spotify_songs.workflow, incremental=incremental)),
+        tasks.Task('votes', partial(votes.workflow, incremental=incremental, **(votes_options or {}))),
+        tasks.Task('rebind_songs', song_winners.rebind_songs, requires=('spotify_songs',)),
+        tasks.Task('merge_collections', spotify_songs.merge_collections, requires=('winner_tables', 'spotify_songs')),
+        tasks.Task('songs_statistics', song_winners.get_songs_statistics, requires=('winner_tables', 'rebind_songs')),
+        tasks.Task('winners_by_location', spotify_songs.extract_winner_from_country, requires=('merge_collections',)),
+        tasks.Task('best_friends', votes.calc_best_friends, requires=('votes',)),
+    ]
+    return {task.name: task for task in graph}
+
+
+def main(incremental=False, task_names=None, with_requirements=False, max_workers=4, metrics_path=None,
+         profile=None, votes_options=None):
+    """
+    Setup global logger for logging progress, create missing collections indexes and validators
     Run all workflows:
     - get all song winners and their counties,
     - bind song name to song data from spotify and get votes
     - get votes from/to country from all over the years
-    :return: None
+    - calculate statistics over the stored data
+    Independent workflows run in parallel, wall time of every task is logged at the end
+    :param incremental: True -> download only data who is not stored yet or marked stale,
+                        rerun after a crash continues where it stopped
+    :param task_names: names of tasks to run, None -> all tasks
+    :param with_requirements: True -> also run the tasks the given tasks require
+    :param max_workers: max tasks running at the same time
+    :param metrics_path: save run metrics to metrics_path.json and metrics_path.prom, None -> only log them
+    :param profile: dict: key: stage name, value: part of the stage calls profiled with cProfile
+    :param votes_options: keyword arguments of votes.workflow, e.g. concurrency, parse_workers, max_requests_per_second
+    :return: dict: key: task name, value: task wall time in seconds
     """
     _setup_logging()
-    song_winners.workflow()
-    spotify_songs.workflow()
-    votes.workflow()
+    for stage, sample_rate in (profile or {}).items():
+        metrics.enable_profiling(stage, sample_rate)
+    graph = build_tasks(incremental=incremental, votes_options=votes_options)
+    if task_names is not None and with_requirements:
+        task_names = tasks.with_requirements(graph, task_names)
+    schema.bootstrap(mongo.get_client())
+    try:
+        return tasks.run(graph, task_names, max_workers=max_workers)
+    finally:
+        metrics.log_summary()
+        if metrics_path:
+            metrics.dump(metrics_path)
+
+
+def _parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Download eurovision data and calculate statistics')
+    parser.add_argument('tasks', nargs='*', help='tasks to run, default: all tasks')
+    parser.add_argument('--incremental', action='store_true', help='download only missing or stale data')
+    parser.add_argument('--with-requirements', action='store_true', help='also run the tasks the given tasks require')
+    parser.add_argument('--workers', type=int, default=4, help='max tasks running at the same time')
+    parser.add_argument('--list', action='store_true', help='list tasks and exit')
+    parser.add_argument('--metrics', metavar='PATH', help='save metrics to PATH.json and PATH.prom')
+    parser.add_argument('--profile', metavar='STAGE[:RATE]', action='append', default=[],
+                        help='profile part of the calls of stage (default rate 1), e.g. get_all_votes:0.1')
+    parser.add_argument('--concurrency', type=int, help='votes pages downloaded at the same time, default: 1')
+    parser.add_argument('--parse-workers', type=int, help='processes parsing votes pages, default: number of cores')
+    parser.add_argument('--max-requests-per-second', type=float,
+                        help='max requests per second sent to eschome, default: no limit')
+    return parser.parse_args(args)
 
 
 if __name__ == "__main__":
-    main()
+    arguments = _parse_args()
+    if arguments.list:
+        for task in build_tasks().values():
+            print(f"{task.name:<24}requires: {', '.join(task.requires) or '-'}")
+    else:
+        main(
+            incremental=arguments.incremental,
+            task_names=arguments.tasks or None,
+            with_requirements=arguments.with_requirements,
+            max_workers=arguments.workers,
+            metrics_path=arguments.metrics,
+            profile={stage: float(rate or 1) for stage, _, rate in (p.partition(':') for p in arguments.profile)},
+            votes_options={name: value for name, value in (
+                ('concurrency', arguments.concurrency),
+                ('parse_workers', arguments.parse_workers),
+                ('max_requests_per_second', arguments.max_requests_per_second)
+            ) if value is not None}
+        )
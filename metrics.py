@@ -0,0 +1,242 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger(__name__)
+
+# Latency histogram buckets upper bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+PROMETHEUS_PREFIX = 'eurovision'
+
+_lock = threading.Lock()
+_stages = {}
+_profiles = {}
+_profile_rates = {}
+# Only one profiler can be active at a time, concurrent or nested stages are not profiled
+_profiling = threading.Lock()
+
+
+class StageMetrics(object):
+    """
+    Metrics of a single stage - calls, errors, latency histogram, bytes and retries
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.bytes = 0
+        self.retries = 0
+
+    def observe(self, seconds, error=False):
+        # type: (float, bool) -> None
+        self.calls += 1
+        self.seconds += seconds
+        if error:
+            self.errors += 1
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def to_dict(self):
+        # type: () -> dict
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'seconds': round(self.seconds, 6),
+            'mean_seconds': round(self.seconds / self.calls, 6) if self.calls else 0.0,
+            'histogram': {('+Inf' if bound == float('inf') else str(bound)): count
+                          for bound, count in zip(BUCKETS, self.buckets)},
+            'bytes': self.bytes,
+            'retries': self.retries
+        }
+
+
+def _stage(name):
+    # type: (str) -> StageMetrics
+    # Called with _lock held
+    stage = _stages.get(name)
+    if stage is None:
+        stage = _stages[name] = StageMetrics()
+    return stage
+
+
+def observe(stage, seconds, error=False):
+    # type: (str, float, bool) -> None
+    """
+    Record one call of stage
+    :param stage: stage name
+    :param seconds: call latency
+    :param error: True if the call raised
+    :return: None
+    """
+    with _lock:
+        _stage(stage).observe(seconds, error)
+
+
+def add_bytes(stage, count):
+    # type: (str, int) -> None
+    """
+    Record bytes transferred by stage
+    :param stage: stage name
+    :param count: number of bytes
+    :return: None
+    """
+    with _lock:
+        _stage(stage).bytes += count
+
+
+def add_retry(stage):
+    # type: (str) -> None
+    """
+    Record one retry of stage
+    :param stage: stage name
+    :return: None
+    """
+    with _lock:
+        _stage(stage).retries += 1
+
+
+def enable_profiling(stage, sample_rate=1.0):
+    # type: (str, float) -> None
+    """
+    Profile calls of stage with cProfile
+    :param stage: stage name
+    :param sample_rate: part of the calls who are profiled, between 0 and 1
+    :return: None
+    """
+    _profile_rates[stage] = sample_rate
+
+
+def _add_profile(stage, profiler):
+    # type: (str, cProfile.Profile) -> None
+    with _lock:
+        if stage in _profiles:
+            _profiles[stage].add(profiler)
+        else:
+            _profiles[stage] = pstats.Stats(profiler)
+
+
+def timed(stage=None):
+    """
+    Decorator who records latency, calls and errors of the decorated function.
+    Calls are profiled when profiling is enabled for the stage
+    :param stage: stage name, None -> function name
+    :return: decorator
+    """
+    def decorator(function):
+        name = stage or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            rate = _profile_rates.get(name)
+            if rate is None or random.random() >= rate or not _profiling.acquire(blocking=False):
+                with timer(name):
+                    return function(*args, **kwargs)
+            profiler = cProfile.Profile()
+            try:
+                with timer(name):
+                    return profiler.runcall(function, *args, **kwargs)
+            finally:
+                _profiling.release()
+                _add_profile(name, profiler)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def timer(stage):
+    """
+    Context manager who records latency, calls and errors of the code block
+    :param stage: stage name
+    """
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started, error)
+
+
+def snapshot():
+    # type: () -> dict
+    """
+    Get all recorded metrics
+    :return: dict: key: stage name, value: dict of stage metrics
+    """
+    with _lock:
+        return {name: stage.to_dict() for name, stage in sorted(_stages.items())}
+
+
+def reset():
+    """
+    Forget all recorded metrics and profiles
+    :return: None
+    """
+    with _lock:
+        _stages.clear()
+        _profiles.clear()
+
+
+def prometheus_text():
+    # type: () -> str
+    """
+    Format metrics in Prometheus text exposition format
+    :return: metrics text
+    """
+    metrics = snapshot()
+    seconds = f'{PROMETHEUS_PREFIX}_stage_seconds'
+    lines = [f'# TYPE {seconds} histogram']
+    for name, stage in metrics.items():
+        cumulative = 0
+        for bound, count in stage['histogram'].items():
+            cumulative += count
+            lines.append(f'{seconds}_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'{seconds}_sum{{stage="{name}"}} {stage["seconds"]}')
+        lines.append(f'{seconds}_count{{stage="{name}"}} {stage["calls"]}')
+    for field in ('errors', 'bytes', 'retries'):
+        counter = f'{PROMETHEUS_PREFIX}_stage_{field}_total'
+        lines.append(f'# TYPE {counter} counter')
+        lines += [f'{counter}{{stage="{name}"}} {stage[field]}' for name, stage in metrics.items()]
+    return '\n'.join(lines) + '\n'
+
+
+def dump(path):
+    # type: (str) -> None
+    """
+    Write metrics to path.json and path.prom, and profiles to path.<stage>.prof
+    :param path: output path without extension
+    :return: None
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f'{path}.json', 'w') as json_file:
+        json.dump(snapshot(), json_file, indent=4)
+    with open(f'{path}.prom', 'w') as prometheus_file:
+        prometheus_file.write(prometheus_text())
+    with _lock:
+        for stage, stats in _profiles.items():
+            stats.dump_stats(f'{path}.{stage}.prof')
+    LOGGER.info(f"Saved metrics. path: {path}")
+
+
+def log_summary():
+    """
+    Log calls, total and mean latency, bytes and retries of every stage
+    :return: None
+    """
+    for name, stage in snapshot().items():
+        LOGGER.info(f"{name:<28} calls: {stage['calls']:<7} errors: {stage['errors']:<4} "
+                    f"seconds: {stage['seconds']:<10.3f} mean: {stage['mean_seconds']:<8.4f} "
+                    f"bytes: {stage['bytes']:<11} retries: {stage['retries']}")
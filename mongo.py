@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+
+from pymongo import InsertOne, MongoClient, ReplaceOne
+from EurovisionStat.winning_eurovision_2019 import metrics
+from EurovisionStat.winning_eurovision_2019.config import db
+
+LOGGER = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+MAX_POOL_SIZE = 50
+CONNECT_TIMEOUT_MS = 5000
+SERVER_SELECTION_TIMEOUT_MS = 10000
+SOCKET_TIMEOUT_MS = 60000
+
+_client = None
+_client_lock = threading.Lock()
+_write_listeners = []
+
+
+def get_client():
+    # type: () -> MongoClient
+    """
+    Get the process wide Mongo client, create it on first use.
+    Importing modules who use the db opens no connection until the first call
+    :return: MongoClient object
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            LOGGER.info(f"Create Mongo client. host: {db.HOST}:{db.PORT}, pool size: {MAX_POOL_SIZE}")
+            _client = MongoClient(
+                f'mongodb://{db.USERNAME}:{db.PASSWORD}@{db.HOST}:{db.PORT}/{db.NAMESPACE}',
+                maxPoolSize=MAX_POOL_SIZE,
+                connectTimeoutMS=CONNECT_TIMEOUT_MS,
+                serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT_MS,
+                socketTimeoutMS=SOCKET_TIMEOUT_MS
+            )
+        return _client
+
+
+def set_client(client):
+    # type: (MongoClient) -> None
+    """
+    Replace the process wide Mongo client, for example with mongomock.MongoClient in tests.
+    None closes the current client, next get_client call creates a new one
+    :param client: Mongo client or None
+    :return: None
+    """
+    global _client
+    with _client_lock:
+        if client is None and _client is not None:
+            _client.close()
+        _client = client
+
+
+def configure(max_pool_size=None, connect_timeout_ms=None, server_selection_timeout_ms=None, socket_timeout_ms=None):
+    # type: (int, int, int, int) -> None
+    """
+    Change Mongo client settings, arguments left out keep their current value.
+    Takes effect on the next client created
+    :param max_pool_size: max open connections
+    :param connect_timeout_ms: connection timeout in milliseconds
+    :param server_selection_timeout_ms: time to find available server in milliseconds
+    :param socket_timeout_ms: time to wait for a response in milliseconds
+    :return: None
+    """
+    global MAX_POOL_SIZE, CONNECT_TIMEOUT_MS, SERVER_SELECTION_TIMEOUT_MS, SOCKET_TIMEOUT_MS
+    with _client_lock:
+        if max_pool_size is not None:
+            MAX_POOL_SIZE = max_pool_size
+        if connect_timeout_ms is not None:
+            CONNECT_TIMEOUT_MS = connect_timeout_ms
+        if server_selection_timeout_ms is not None:
+            SERVER_SELECTION_TIMEOUT_MS = server_selection_timeout_ms
+        if socket_timeout_ms is not None:
+            SOCKET_TIMEOUT_MS = socket_timeout_ms
+
+
+def add_write_listener(listener):
+    # type: (callable) -> None
+    """
+    Call listener after every write done by this process, e.g. to invalidate cached results
+    :param listener: callable who gets the written collection name
+    :return: None
+    """
+    _write_listeners.append(listener)
+
+
+def remove_write_listener(listener):
+    # type: (callable) -> None
+    if listener in _write_listeners:
+        _write_listeners.remove(listener)
+
+
+def notify_write(collection_name):
+    # type: (str) -> None
+    """
+    Tell the write listeners collection has new data. BulkWriter and insert_to_db call it on their own,
+    code who writes with the collection methods calls it after the write
+    :param collection_name: written collection
+    :return: None
+    """
+    for listener in list(_write_listeners):
+        listener(collection_name)
+
+
+class BulkWriter(object):
+    """
+    Buffer documents and write them to collection with one unordered bulk_write per batch.
+    With upsert_keys, each document replaces the stored document with the same keys,
+    so writing the same data twice does not duplicate it
+    """
+
+    def __init__(self, client, collection_name, batch_size=BATCH_SIZE, flush_interval=None, upsert_keys=None):
+        # type: (MongoClient, str, int, float, tuple) -> None
+        """
+        :param client: Mongo client
+        :param collection_name: collection to store the documents
+        :param batch_size: flush when this number of documents is buffered
+        :param flush_interval: flush when this number of seconds passed since last flush, None -> size only
+        :param upsert_keys: document fields who identify a document, None -> plain inserts
+        """
+        self.collection = client.eurovision[collection_name]
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.upsert_keys = upsert_keys
+        self.written = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def add(self, document):
+        # type: (dict) -> None
+        """
+        Buffer document, flush buffer if batch is full or flush interval passed
+        :param document: dict to store
+        :return: None
+        """
+        if self.upsert_keys:
+            operation = ReplaceOne({key: document[key] for key in self.upsert_keys}, document, upsert=True)
+        else:
+            operation = InsertOne(document)
+        with self._lock:
+            self._buffer.append(operation)
+            if len(self._buffer) >= self.batch_size or (
+                    self.flush_interval is not None and time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush()
+
+    def add_many(self, documents):
+        # type: (list) -> None
+        """
+        Buffer list of documents, see add
+        :param documents: list of dicts to store
+        :return: None
+        """
+        for document in documents:
+            self.add(document)
+
+    def flush(self):
+        """
+        Write all buffered documents
+        :return: None
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        operations, self._buffer = self._buffer, []
+        LOGGER.info(f"Write {len(operations)} documents to collection: {self.collection_name}")
+        with metrics.timer('mongo.bulk_write'):
+            self.collection.bulk_write(operations, ordered=False)
+        self.written += len(operations)
+        notify_write(self.collection_name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+
+@metrics.timed()
+def insert_to_db(client, documents, collection_name, upsert_keys=None):
+    """
+    Insert document or list of document (dict or JSON) to db in bulk
+    :param client: Mongo client
+    :param documents: dict or list of dicts to store
+    :param collection_name: collection to store the documents
+    :param upsert_keys: document fields who identify a document, replace existing document instead of inserting
+    :return: None
+    :raise: TypeError if documents not in correct type (dict or list)
+    """
+    if type(documents) is dict:
+        documents = [documents]
+    if type(documents) is not list:
+        raise TypeError
+    with BulkWriter(client, collection_name, upsert_keys=upsert_keys) as writer:
+        writer.add_many(documents)
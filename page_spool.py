@@ -0,0 +1,93 @@
+import gzip
+import json
+import logging
+import os
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+SPOOL_DIR = os.environ.get(
+    'EUROVISION_SPOOL_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'eurovision_stat_pages')
+)
+
+
+def configure(directory=None):
+    # type: (str) -> None
+    """
+    Change spool settings, arguments left out keep their current value
+    :param directory: spool directory
+    :return: None
+    """
+    global SPOOL_DIR
+    if directory is not None:
+        SPOOL_DIR = directory
+
+
+def page_path(kind, job):
+    # type: (str, tuple) -> str
+    """
+    Path of the raw page of a job, same job -> same path, so a new download replaces the old page
+    :param kind: page kind, e.g. votes
+    :param job: tuple of str/int/bool who identify the request, first item is the country code
+    :return: file path
+    """
+    name = '-'.join(str(int(part) if isinstance(part, bool) else part).replace(os.sep, '_') for part in job)
+    return os.path.join(SPOOL_DIR, kind, f'{name}.gz')
+
+
+def store(kind, job, content, meta=None):
+    # type: (str, tuple, bytes, dict) -> str
+    """
+    Save compressed raw page
+    :param kind: page kind, e.g. votes
+    :param job: tuple who identify the request
+    :param content: raw page
+    :param meta: JSON serializable data needed to parse the page again, e.g. country name
+    :return: file path
+    """
+    path = page_path(kind, job)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    header = json.dumps({'job': list(job), 'meta': meta or {}}).encode('utf-8')
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as page_file:
+        page_file.write(header + b'\n' + gzip.compress(content, compresslevel=1))
+    os.replace(tmp_path, path)
+    return path
+
+
+def load(path):
+    # type: (str) -> tuple
+    """
+    Read page saved with store
+    :param path: file path
+    :return: (job list, meta dict, raw page) tuple
+    """
+    with open(path, 'rb') as page_file:
+        header = json.loads(page_file.readline())
+        content = gzip.decompress(page_file.read())
+    return header['job'], header['meta'], content
+
+
+def load_header(path):
+    # type: (str) -> tuple
+    """
+    Read only the job and meta of a page saved with store, without decompressing the page
+    :param path: file path
+    :return: (job list, meta dict) tuple
+    """
+    with open(path, 'rb') as page_file:
+        header = json.loads(page_file.readline())
+    return header['job'], header['meta']
+
+
+def list_pages(kind):
+    # type: (str) -> list[str]
+    """
+    List saved pages of a kind
+    :param kind: page kind, e.g. votes
+    :return: sorted list of file paths
+    """
+    directory = os.path.join(SPOOL_DIR, kind)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(entry.path for entry in os.scandir(directory) if entry.name.endswith('.gz'))
@@ -0,0 +1,119 @@
+import logging
+
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.dammit import EncodingDetector, UnicodeDammit
+from EurovisionStat.winning_eurovision_2019 import metrics
+
+try:
+    import lxml  # noqa: F401 - only checked for availability, used by BeautifulSoup
+    _HAS_LXML = True
+except ImportError:
+    _HAS_LXML = False
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        HTMLParser = None
+
+LOGGER = logging.getLogger(__name__)
+
+BACKENDS = ('selectolax', 'lxml', 'html.parser')
+
+if HTMLParser is not None:
+    BACKEND = 'selectolax'
+elif _HAS_LXML:
+    BACKEND = 'lxml'
+else:
+    BACKEND = 'html.parser'
+
+
+def available_backends():
+    # type: () -> list[str]
+    """
+    Get parser backends who can be used in this environment
+    :return: list of backend names, fastest first
+    """
+    available = {
+        'selectolax': HTMLParser is not None,
+        'lxml': _HAS_LXML,
+        'html.parser': True
+    }
+    return [backend for backend in BACKENDS if available[backend]]
+
+
+def set_backend(backend):
+    # type: (str) -> None
+    """
+    Choose parser backend
+    :param backend: one of BACKENDS
+    :return: None
+    :raise: ValueError if backend is unknown or not installed
+    """
+    global BACKEND
+    if backend not in available_backends():
+        raise ValueError(f"Parser backend is not available: {backend}")
+    LOGGER.info(f"Use HTML parser backend: {backend}")
+    BACKEND = backend
+
+
+def _soup_backend():
+    # type: () -> str
+    # BeautifulSoup can't use selectolax, fall back to the next fastest tree builder
+    if BACKEND == 'selectolax':
+        return 'lxml' if _HAS_LXML else 'html.parser'
+    return BACKEND
+
+
+@metrics.timed()
+def make_soup(content, parse_only=None):
+    # type: (bytes, SoupStrainer) -> BeautifulSoup
+    """
+    Parse html to BeautifulSoup with the fastest tree builder of the chosen backend
+    :param content: html content
+    :param parse_only: SoupStrainer who restricts the parse to the wanted nodes
+    :return: BeautifulSoup object
+    """
+    return BeautifulSoup(content, _soup_backend(), parse_only=parse_only)
+
+
+def decode(content):
+    # type: (bytes) -> str
+    """
+    Decode html like BeautifulSoup does - byte order mark, then <meta charset>, then UTF-8,
+    so every backend gets the same text
+    :param content: html content
+    :return: html text
+    """
+    if isinstance(content, str):
+        return content
+    content, encoding = EncodingDetector.strip_byte_order_mark(content)
+    encoding = encoding or EncodingDetector.find_declared_encoding(content, is_html=True) or 'utf-8'
+    try:
+        return content.decode(encoding)
+    except (LookupError, UnicodeDecodeError):
+        return UnicodeDammit(content, is_html=True).unicode_markup
+
+
+@metrics.timed()
+def table_rows(content, table_id):
+    # type: (bytes, str) -> list[list[str]]
+    """
+    Parse only the table with the given id and extract the text of every row cells in one pass
+    :param content: html content
+    :param table_id: id attribute of wanted table
+    :return: list of rows, each row is a list of its td texts. None if table is not in content
+    """
+    if BACKEND == 'selectolax':
+        # selectolax always decodes bytes as UTF-8
+        table = HTMLParser(decode(content)).css_first(f'table#{table_id}')
+        if table is None:
+            return None
+        return [[td.text() for td in row.css('td')] for row in table.css('tr')]
+    soup = make_soup(content, parse_only=SoupStrainer('table', attrs={'id': table_id}))
+    table = soup.find('table', {'id': table_id})
+    if table is None:
+        return None
+    return [[td.text for td in row.find_all('td')] for row in table.find_all('tr')]
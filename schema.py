@@ -0,0 +1,151 @@
+import logging
+
+from pymongo import ASCENDING, TEXT, DeleteOne, IndexModel, UpdateOne
+from pymongo.errors import OperationFailure
+from EurovisionStat.winning_eurovision_2019 import countries, mongo
+
+LOGGER = logging.getLogger(__name__)
+
+INDEXES = {
+    'points_by_year_given_from': [
+        IndexModel([('country_id', ASCENDING), ('year', ASCENDING)], unique=True, name='country_id_year_unique',
+                   partialFilterExpression={'country_id': {'$type': 'int'}}),
+        IndexModel([('year', ASCENDING)], name='year')
+    ],
+    'points_by_year_given_to': [
+        IndexModel([('country_id', ASCENDING), ('year', ASCENDING)], unique=True, name='country_id_year_unique',
+                   partialFilterExpression={'country_id': {'$type': 'int'}}),
+        IndexModel([('year', ASCENDING)], name='year')
+    ],
+    'winners_songs_spotify': [
+        IndexModel([('id', ASCENDING)], unique=True, name='id'),
+        IndexModel([('name', TEXT)], name='name_text')
+    ],
+    'countries': [
+        IndexModel([('code', ASCENDING)], name='code')
+    ],
+    'winners_by_year': [
+        IndexModel([('year', ASCENDING)], name='year'),
+        IndexModel([('host_city', ASCENDING)], name='host_city'),
+        IndexModel([('song.name', TEXT)], name='song_name_text')
+    ]
+}
+
+VOTES_COLLECTIONS = ('points_by_year_given_from', 'points_by_year_given_to')
+
+# Documents inserted or updated must match, documents already stored are left as they are
+VALIDATORS = {
+    'points_by_year_given_from': {'$jsonSchema': {
+        'bsonType': 'object',
+        'required': ['country_id', 'year', 'voted'],
+        'properties': {
+            'country_id': {'bsonType': 'int'}, 'country': {'bsonType': 'string'}, 'year': {'bsonType': 'int'},
+            'voted': {'bsonType': 'array'}
+        }
+    }},
+    'points_by_year_given_to': {'$jsonSchema': {
+        'bsonType': 'object',
+        'required': ['country_id', 'year', 'voted'],
+        'properties': {
+            'country_id': {'bsonType': 'int'}, 'country': {'bsonType': 'string'}, 'year': {'bsonType': 'int'},
+            'voted': {'bsonType': 'array'}
+        }
+    }},
+    'winners_songs_spotify': {'$jsonSchema': {
+        'bsonType': 'object',
+        'required': ['id', 'name'],
+        'properties': {'id': {'bsonType': 'string'}, 'name': {'bsonType': 'string'}}
+    }}
+}
+
+
+def ensure_indexes(database):
+    """
+    Create missing indexes, existing indexes are left as they are.
+    An index who can not be built (e.g. unique index over duplicated stored documents) is logged and skipped
+    :param database: Mongo eurovision database
+    :return: None
+    """
+    for collection_name, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                database[collection_name].create_indexes([index])
+            except OperationFailure as e:
+                LOGGER.error(f"Can't create index. collection: {collection_name}, "
+                             f"index: {index.document['name']}, error: {e}")
+        LOGGER.info(f"Indexes are ready. collection: {collection_name}")
+
+
+def ensure_validators(database):
+    """
+    Create collections with their validator, or set the validator of existing collections
+    :param database: Mongo eurovision database
+    :return: None
+    """
+    existing = set(database.list_collection_names())
+    for collection_name, validator in VALIDATORS.items():
+        if collection_name in existing:
+            database.command('collMod', collection_name, validator=validator, validationLevel='moderate')
+        else:
+            database.create_collection(collection_name, validator=validator, validationLevel='moderate')
+        LOGGER.info(f"Validator is set. collection: {collection_name}")
+
+
+def migrate_country_ids(database, registry=None):
+    # type: (Database, countries.CountryRegistry) -> int
+    """
+    Add country ids to votes documents stored before the ids were added, so they are upserted on (country_id, year)
+    instead of stored twice. An old document whose country already has a document with ids of the same year
+    is deleted, the newer one is kept. Documents of countries who are not registered yet are left for the next run
+    :param database: Mongo eurovision database
+    :param registry: countries registry, None -> the process wide registry
+    :return: number of migrated documents
+    """
+    registry = registry or countries.get_registry()
+    migrated = 0
+    for collection_name in VOTES_COLLECTIONS:
+        collection = database[collection_name]
+        old_documents = list(collection.find({'country_id': {'$exists': False}}))
+        if not old_documents:
+            continue
+        stored = {(doc['country_id'], doc['year'])
+                  for doc in collection.find({'country_id': {'$type': 'int'}}, {'_id': 0, 'country_id': 1, 'year': 1})}
+        operations = []
+        unknown = 0
+        for doc in old_documents:
+            country_id = registry.lookup(doc.get('country') or '')
+            if country_id is None:
+                unknown += 1
+            elif (country_id, doc['year']) in stored:
+                operations.append(DeleteOne({'_id': doc['_id']}))
+            else:
+                stored.add((country_id, doc['year']))
+                voted = []
+                for vote in doc.get('voted', []):
+                    vote_country_id = registry.lookup(vote.get('country') or '')
+                    voted.append({'country_id': vote_country_id, 'points': vote.get('points')}
+                                 if vote_country_id is not None else vote)
+                operations.append(UpdateOne({'_id': doc['_id']}, {'$set': {
+                    'country_id': country_id, 'country': registry.name(country_id), 'voted': voted
+                }}))
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+            mongo.notify_write(collection_name)
+            migrated += len(operations)
+        LOGGER.info(f"Migrated votes documents to country ids. collection: {collection_name}, "
+                    f"documents: {len(operations)}, unknown countries: {unknown}")
+    return migrated
+
+
+def bootstrap(client):
+    # type: (MongoClient) -> None
+    """
+    Prepare eurovision collections - validators, country ids of old votes documents and indexes.
+    Safe to run before every run
+    :param client: Mongo client
+    :return: None
+    """
+    database = client.eurovision
+    ensure_validators(database)
+    migrate_country_ids(database, countries.CountryRegistry(database[countries.COLLECTION]))
+    ensure_indexes(database)
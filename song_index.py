@@ -0,0 +1,122 @@
+import logging
+import re
+import unicodedata
+from difflib import SequenceMatcher
+
+LOGGER = logging.getLogger(__name__)
+
+# Matches under this confidence are reported and not bound
+MIN_CONFIDENCE = 0.8
+# Confidence given when titles are equal without spaces, e.g. "Fairy tale" and "Fairytale"
+COMPACT_CONFIDENCE = 0.95
+# Confidence given when one normalized title contains the other, e.g. "Euphoria" in "Euphoria (Radio Edit)"
+CONTAINED_CONFIDENCE = 0.9
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_title(title):
+    # type: (str) -> str
+    """
+    Normalize song title for matching - lower case, without accents and punctuation, single spaces
+    :param title: song title
+    :return: normalized title
+    """
+    decomposed = unicodedata.normalize('NFKD', title)
+    without_accents = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    without_punctuation = _PUNCTUATION.sub(' ', without_accents.lower())
+    return _SPACES.sub(' ', without_punctuation).strip()
+
+
+class SongIndex(object):
+    """
+    In memory index of Spotify songs by normalized title.
+    Exact normalized titles are found with one dict lookup, near misses are scored only against
+    songs who share a title word
+    """
+
+    def __init__(self, songs, fuzzy=True):
+        # type: (iter, bool) -> None
+        """
+        :param songs: iterable of song documents with 'name' field
+        :param fuzzy: False -> only exact normalized titles match
+        """
+        self.fuzzy = fuzzy
+        self._by_title = {}
+        self._by_compact = {}
+        self._by_token = {}
+        for song in songs:
+            title = normalize_title(song['name'])
+            if not title or title in self._by_title:
+                continue
+            self._by_title[title] = song
+            self._by_compact.setdefault(title.replace(' ', ''), title)
+            for token in set(title.split(' ')):
+                self._by_token.setdefault(token, []).append(title)
+        LOGGER.info(f"Built song index. songs: {len(self._by_title)}")
+
+    @classmethod
+    def from_collection(cls, collection, fuzzy=True):
+        """
+        Build index from all songs in Mongo collection, in one query
+        :param collection: Mongo collection of Spotify songs
+        :param fuzzy: False -> only exact normalized titles match
+        :return: SongIndex object
+        """
+        return cls(collection.find({}), fuzzy=fuzzy)
+
+    def __len__(self):
+        return len(self._by_title)
+
+    def match(self, title):
+        # type: (str) -> tuple
+        """
+        Find the song who best matches the given title
+        :param title: song title
+        :return: (song document, confidence between 0 and 1), (None, 0.0) if nothing matches
+        """
+        normalized = normalize_title(title)
+        song = self._by_title.get(normalized)
+        if song is not None:
+            return song, 1.0
+        if not self.fuzzy or not normalized:
+            return None, 0.0
+        compact_title = self._by_compact.get(normalized.replace(' ', ''))
+        if compact_title is not None:
+            return self._by_title[compact_title], COMPACT_CONFIDENCE
+        candidates = {
+            candidate
+            for token in normalized.split(' ')
+            for candidate in self._by_token.get(token, ())
+        }
+        best_title, best_score = None, 0.0
+        for candidate in candidates:
+            score = SequenceMatcher(None, normalized, candidate).ratio()
+            if candidate in normalized or normalized in candidate:
+                score = max(score, CONTAINED_CONFIDENCE)
+            if score > best_score:
+                best_title, best_score = candidate, score
+        if best_title is None:
+            return None, 0.0
+        return self._by_title[best_title], round(best_score, 3)
+
+    def bind(self, title, min_confidence=MIN_CONFIDENCE):
+        # type: (str, float) -> tuple
+        """
+        Match title and log matches who are not bound, so bad bindings are visible
+        :param title: song title
+        :param min_confidence: lowest confidence accepted as a match
+        :return: (song document, confidence), song is None if no match reached min_confidence
+        """
+        song, confidence = self.match(title)
+        if song is None:
+            LOGGER.warning(f"No Spotify song matches. title: {title}")
+            return None, confidence
+        if confidence < min_confidence:
+            LOGGER.warning(f"Spotify song match under confidence. title: {title}, "
+                           f"best match: {song['name']}, confidence: {confidence}")
+            return None, confidence
+        if confidence < 1.0:
+            LOGGER.info(f"Fuzzy Spotify song match. title: {title}, match: {song['name']}, confidence: {confidence}")
+        return song, confidence
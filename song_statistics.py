@@ -0,0 +1,167 @@
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+# First matching substring names the genre bucket
+GENRE_BUCKETS = (('pop', 'pop'), ('classic', 'classic'), ('rock', 'rock'))
+
+
+class Dimension(object):
+    """
+    Statistic counted over winner records - a function who maps a record to its buckets
+    """
+
+    def __init__(self, name, function, buckets=()):
+        # type: (str, callable, tuple) -> None
+        """
+        :param name: statistic name, key of its counters in the result
+        :param function: callable who gets (year, winner, context) and returns a bucket, an iterable of buckets
+                         (every bucket is counted), or None if the record has no value for this dimension
+        :param buckets: buckets who are always in the result, even with zero count
+        """
+        self.name = name
+        self.function = function
+        self.buckets = tuple(buckets)
+
+    def __repr__(self):
+        return f'Dimension({self.name!r})'
+
+
+def song_key(year, winner, context):
+    # type: (str or int, dict, dict) -> str
+    """
+    Musical key of the winning song
+    :param year: contest year, key of the winners dict
+    :param winner: winner record with bound Spotify 'song' dict
+    :param context: lookups shared by the dimensions functions
+    :return: key name, e.g. 'C#', None if Spotify has no key
+    """
+    return winner['song'].get('key')
+
+
+def language(year, winner, context):
+    # type: (str or int, dict, dict) -> str
+    """
+    Language of the winning song, from context['languages']
+    :param year: contest year, key of the winners dict
+    :param winner: winner record with bound Spotify 'song' dict
+    :param context: lookups shared by the dimensions functions
+    :return: 'english' or 'other', None if the year has no language
+    """
+    song_language = context['languages'].get(year)
+    if song_language is None:
+        return None
+    return 'english' if song_language == 'english' else 'other'
+
+
+def composition(year, winner, context):
+    # type: (str or int, dict, dict) -> str
+    """
+    Whether the winner is a band or a solo artist
+    :param year: contest year, key of the winners dict
+    :param winner: winner record with bound Spotify 'song' dict
+    :param context: lookups shared by the dimensions functions
+    :return: 'band' if the song has more than one artist, else 'solo', None without artists
+    """
+    artists = winner['song'].get('artist')
+    if not artists:
+        return None
+    return 'band' if len(artists) > 1 else 'solo'
+
+
+def genre(year, winner, context):
+    # type: (str or int, dict, dict) -> list
+    """
+    Genre buckets of the first artist of the winning song, see GENRE_BUCKETS
+    :param year: contest year, key of the winners dict
+    :param winner: winner record with bound Spotify 'song' dict
+    :param context: lookups shared by the dimensions functions
+    :return: list of buckets, one per genre, None without genres
+    """
+    genres = winner['song'].get('genres')
+    if not genres:
+        return None
+    # Genres of the first artist, every genre is counted
+    buckets = []
+    for song_genre in genres[0]:
+        genre_lower = song_genre.lower()
+        buckets.append(next((bucket for part, bucket in GENRE_BUCKETS if part in genre_lower), 'other'))
+    return buckets
+
+
+def decade(year, winner, context):
+    # type: (str or int, dict, dict) -> str
+    """
+    Decade of the contest
+    :param year: contest year, key of the winners dict
+    :param winner: winner record with bound Spotify 'song' dict
+    :param context: lookups shared by the dimensions functions
+    :return: decade, e.g. '1990s', None if year does not start with a year
+    """
+    if not str(year)[:4].isdigit():
+        return None
+    return f'{int(str(year)[:4]) // 10 * 10}s'
+
+
+def host_city(year, winner, context):
+    # type: (str or int, dict, dict) -> str
+    """
+    City the contest was held in
+    :param year: contest year, key of the winners dict
+    :param winner: winner record with bound Spotify 'song' dict
+    :param context: lookups shared by the dimensions functions
+    :return: city name, None if unknown
+    """
+    return winner.get('host_city') or None
+
+
+DIMENSIONS = (
+    Dimension('key', song_key),
+    Dimension('lang', language, buckets=('english', 'other')),
+    Dimension('composition', composition, buckets=('band', 'solo')),
+    Dimension('genre', genre, buckets=('pop', 'classic', 'rock', 'other')),
+    Dimension('decade', decade),
+    Dimension('host_city', host_city)
+)
+
+
+def languages_by_year(languages_table):
+    # type: (dict) -> dict
+    """
+    Index the wikipedia winners by language table by year
+    :param languages_table: dict: key: language, value: dict with 'years' list
+    :return: dict: key: year, value: lower case language
+    """
+    languages = {}
+    for lang, row in languages_table.items():
+        if isinstance(row, dict):
+            for year in row.get('years', []):
+                languages[year] = lang.lower()
+    return languages
+
+
+def aggregate(winners, dimensions=DIMENSIONS, context=None):
+    # type: (dict, tuple, dict) -> dict
+    """
+    Count all dimensions in a single pass over the winners
+    :param winners: dict: key: year, value: winner record with bound Spotify 'song' dict
+    :param dimensions: Dimension objects to count
+    :param context: lookups shared by the dimensions functions, e.g. 'languages' by year
+    :return: dict: key: dimension name, value: dict: key: bucket, value: count
+    """
+    context = context or {}
+    counters = {dimension.name: dict.fromkeys(dimension.buckets, 0) for dimension in dimensions}
+    songs = 0
+    for year, winner in winners.items():
+        if not isinstance(winner, dict) or not isinstance(winner.get('song'), dict):
+            continue
+        songs += 1
+        for dimension in dimensions:
+            buckets = dimension.function(year, winner, context)
+            if buckets is None:
+                continue
+            counter = counters[dimension.name]
+            for bucket in ([buckets] if isinstance(buckets, str) else buckets):
+                counter[bucket] = counter.get(bucket, 0) + 1
+    LOGGER.info(f"Aggregated songs statistics. songs: {songs}, dimensions: {len(dimensions)}")
+    return counters
@@ -1,15 +1,23 @@
 import logging
 from bson import ObjectId
-from pymongo import MongoClient
-from urllib.request import urlopen
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from EurovisionStat.winning_eurovision_2019 import countries, http_client, metrics, mongo, parsers, song_statistics
+from EurovisionStat.winning_eurovision_2019.song_index import SongIndex
+from EurovisionStat.winning_eurovision_2019.votes import LAST_YEAR
 from EurovisionStat.winning_eurovision_2019.config import db
 from EurovisionStat.winning_eurovision_2019.config.urls import LIST_OF_EUROVISION_SONG_WINNERS
 
 
 LOGGER = logging.getLogger(__name__)
 
+WINNER_TABLES = SoupStrainer("table", {'class': 'wikitable'})
+# _id of the wikipedia collection documents, in parse_winner_tables order
+WIKIPEDIA_TABLES = ('by_year', 'by_country', 'by_lang')
+# _id of the single winner_by_year_new document
+WINNERS_DOCUMENT_ID = 'winners'
 
+
+@metrics.timed()
 def parse_by_year(table):
     # type: (BeautifulSoup) -> dict
     """
@@ -45,6 +53,7 @@ def parse_by_year(table):
     return winner_by_year
 
 
+@metrics.timed()
 def parse_by_country(table):
     # type: (BeautifulSoup) -> dict
     """
@@ -73,6 +82,7 @@ def parse_by_country(table):
     return winner_by_country
 
 
+@metrics.timed()
 def parse_by_lang(table):
     # type: (BeautifulSoup) -> dict
     """
@@ -110,36 +120,30 @@ def insert_to_db(documents):
     :return: None
     :raise: TypeError if documents not in correct type (dict or list)
     """
-    client = MongoClient(f'mongodb://{db.USERNAME}:{db.PASSWORD}@{db.HOST}:{db.PORT}/{db.NAMESPACE}')
-    eurovision_db = client.eurovision
     LOGGER.info(f"Save documents to collection: wikipedia")
-    if type(documents) is dict:
-        documents = [documents]
-    if type(documents) is list:
-        for doc in documents:
-            wikipedia = eurovision_db.wikipedia
-            wikipedia.insert_one(doc)
-    else:
-        raise TypeError
+    mongo.insert_to_db(mongo.get_client(), documents, 'wikipedia')
 
 
-def download_html(url):
-    # type: (str) -> BeautifulSoup
+@metrics.timed()
+def download_html(url, parse_only=None):
+    # type: (str, SoupStrainer) -> BeautifulSoup
     """
     Download html from given url and return BeautifulSoup for parse the html
     :param url: url for the wanted html
+    :param parse_only: SoupStrainer who restricts the parse to the wanted nodes, None -> parse all page
     :return: BeautifulSoup object with the downloaded html content
     """
     LOGGER.info(f"Downloading HTML content. URL: {url}")
-    content = urlopen(url).read()
-    return BeautifulSoup(content, 'html.parser')
+    content = http_client.get(url)
+    return parsers.make_soup(content, parse_only=parse_only)
 
 
 def parse_winner_tables(node):
     # type: (BeautifulSoup) -> list[dict]
     """
     Parse winner tables from given html node
-    :param node: BeautifulSoup object with winner tables inside
+    :param node: BeautifulSoup object with winner tables inside,
+                 download_html(url, parse_only=WINNER_TABLES) parses only these tables
     :return: list of parsed tables -> from html to Python dict
     """
     winners_tables = node.find_all("table", {'class': 'wikitable'})
@@ -149,109 +153,89 @@ def parse_winner_tables(node):
     return [winner_by_year, winner_by_country, winner_by_lang]
 
 
-def rebind_songs():
+def add_country_ids(winner_by_year, winner_by_country):
+    # type: (dict, dict) -> None
+    """
+    Add countries registry ids to parsed winner tables - 'winner_id' to every year and 'country_id' to every country.
+    Wikipedia names who don't match a registered country are logged and get None
+    :param winner_by_year: parsed winners by year table
+    :param winner_by_country: parsed winners by country table
+    :return: None
+    """
+    registry = countries.get_registry()
+    for winner in winner_by_year.values():
+        winner['winner_id'] = registry.lookup(winner['winner'])
+    for country, row in winner_by_country.items():
+        row['country_id'] = registry.lookup(country)
+
+
+def rebind_songs(fuzzy=False):
+    # type: (bool) -> None
     """
     Bind songs data from spotify to song name in winner collection
     Insert binding data to new collection
+    :param fuzzy: True -> also bind near miss titles, with their match confidence
     :return: None
     """
-    client = MongoClient(f'mongodb://{db.USERNAME}:{db.PASSWORD}@{db.HOST}:{db.PORT}/{db.NAMESPACE}')
-    eurovision_db = client.eurovision
+    eurovision_db = mongo.get_client().eurovision
     LOGGER.info(f"Get spotify songs")
+    songs_index = SongIndex.from_collection(eurovision_db["winners_songs_spotify"], fuzzy=fuzzy)
     winners_by_year_new = {}
     old_winners = db.ALL_WINNERS_BY_YEAR
     for year in old_winners:
-        old_winner_song = old_winners[year]['song'].lower()
-        spotify_songs = eurovision_db["winners_songs_spotify"].find({})
-        for song in spotify_songs:
-            if song['name'].lower() == old_winner_song:
-                old_winners[year]['song'] = song
-                winners_by_year_new[year] = old_winners[year]
-                break
-    eurovision_db['winner_by_year_new'].insert_one(winners_by_year_new)
+        song, confidence = songs_index.bind(old_winners[year]['song'])
+        if song is not None:
+            old_winners[year]['song'] = song
+            old_winners[year]['song_match_confidence'] = confidence
+            winners_by_year_new[year] = old_winners[year]
+    eurovision_db['winner_by_year_new'].replace_one({'_id': WINNERS_DOCUMENT_ID}, winners_by_year_new, upsert=True)
+    mongo.notify_write('winner_by_year_new')
 
 
-def get_songs_statistics():
+def get_songs_statistics(dimensions=song_statistics.DIMENSIONS):
+    # type: (tuple) -> dict
     """
-    Calculate song statistic from all winners songs over the year
+    Calculate song statistic from all winners songs over the year, all dimensions are counted in one pass
+    :param dimensions: song_statistics.Dimension objects to count
     :return: dict object with calculated data
     """
-    client = MongoClient(f'mongodb://{db.USERNAME}:{db.PASSWORD}@{db.HOST}:{db.PORT}/{db.NAMESPACE}')
-    eurovision_db = client.eurovision
+    eurovision_db = mongo.get_client().eurovision
     LOGGER.info(f"Get winners collection")
-    winners_collection = eurovision_db["winner_by_year_new"].find_one({})
-    lang_coll = eurovision_db["wikipedia"].find()[1]
-    lang_coll.pop('_id', None)
-    for lang in lang_coll:
-        try:
-            years = lang_coll[lang]['years']
-            for year in years:
-                for winner_year in winners_collection:
-                    if year == winner_year:
-                        winner = winners_collection[year]
-                        winner['song']['language'] = lang.lower()
-        except:
-            pass
-    print(f"winner: {winners_collection}")
-    eurovision_db["winner_by_year_new"].update_one({}, {"$set": winners_collection})
-    winners_collection = eurovision_db["winner_by_year_new"].find_one({})
-    winners_collection.pop('_id', None)
-    songs_statistics = {
-        'key': {},
-        'lang': {
-            'english': 0,
-            'other': 0
-        },
-        "composition": {
-            'band': 0,
-            'solo': 0
-        },
-        "genre": {
-            'pop': 0,
-            'classic': 0,
-            'rock': 0,
-            'other': 0
-        }
-    }
-    all_songs = 0
+    winners_collection = eurovision_db["winner_by_year_new"].find_one({'_id': WINNERS_DOCUMENT_ID}, {'_id': 0}) or {}
+    lang_coll = eurovision_db["wikipedia"].find_one({'_id': 'by_lang'}, {'_id': 0}) or {}
+    context = {'languages': song_statistics.languages_by_year(lang_coll)}
     LOGGER.info(f"Getting tune statistics")
-    for year in winners_collection:
-        winner = winners_collection[year]
-        try:
-            song_key = winner['song']['key']
-            song_lang = winner['song']['language']
-            composition = winner['song']['artist']
-            song_genres = winner['song']['genres'][0]
-            for genre in song_genres:
-                genre_lower = genre.lower()
-                if 'pop' in genre_lower:
-                    songs_statistics['genre']['pop'] += 1
-                elif 'classic' in genre_lower:
-                    songs_statistics['genre']['classic'] += 1
-                elif 'rock' in genre_lower:
-                    songs_statistics['genre']['rock'] += 1
-                else:
-                    songs_statistics['genre']['other'] += 1
-            if song_lang == 'english':
-                songs_statistics['lang'][song_lang] += 1
-            else:
-                songs_statistics['lang']['other'] += 1
-            if len(composition) > 1:
-                songs_statistics['composition']['band'] += 1
-            else:
-                songs_statistics['composition']['solo'] += 1
-
-            try:
-                songs_statistics['key'][song_key] += 1
-            except KeyError:
-                songs_statistics['key'][song_key] = 1
-            finally:
-                all_songs += 1
-        except KeyError:
-            print(f"error: {winner}")
-    eurovision_db['songs_statistic'].insert_one(songs_statistics)
+    songs_statistics = song_statistics.aggregate(winners_collection, dimensions, context)
+    eurovision_db['songs_statistic'].insert_one(dict(songs_statistics))
+    mongo.notify_write('songs_statistic')
     return songs_statistics
 
 
-def workflow():
+def update_winner_tables(incremental=False, last_year=LAST_YEAR):
+    # type: (bool, int) -> None
+    """
+    Download wikipedia winners tables and replace the stored tables with them, _id of every table is its
+    WIKIPEDIA_TABLES name
+    :param incremental: True -> skip download if the stored tables already have last_year winner
+    :param last_year: last contest year
+    :return: None
+    """
+    wikipedia = mongo.get_client().eurovision['wikipedia']
+    if incremental and wikipedia.find_one({'_id': 'by_year', str(last_year): {'$exists': True}}, {'_id': 1}):
+        LOGGER.info(f"Winners tables are up to date. last year: {last_year}")
+        return
+    tables = parse_winner_tables(download_html(LIST_OF_EUROVISION_SONG_WINNERS, parse_only=WINNER_TABLES))
+    add_country_ids(tables[0], tables[1])
+    wikipedia.delete_many({})
+    insert_to_db([dict(table, _id=name) for name, table in zip(WIKIPEDIA_TABLES, tables)])
+
+
+def workflow(incremental=False):
+    # type: (bool) -> None
+    """
+    Update winners tables and calculate songs statistics
+    :param incremental: True -> download winners tables only if a new contest is missing
+    :return: None
+    """
+    update_winner_tables(incremental=incremental)
     get_songs_statistics()
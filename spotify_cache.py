@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+CACHE_PATH = os.environ.get(
+    'EUROVISION_SPOTIFY_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'eurovision_stat', 'spotify.sqlite')
+)
+ENABLED = True
+# Artists genres change over time, seconds until cached genres are stale. None -> never
+GENRES_TTL = 7 * 24 * 60 * 60
+
+_connection = None
+_lock = threading.Lock()
+
+
+def configure(path=None, enabled=None, genres_ttl=-1):
+    # type: (str, bool, int) -> None
+    """
+    Change cache settings, arguments left out keep their current value
+    :param path: sqlite file path
+    :param enabled: False -> never read or write the cache
+    :param genres_ttl: seconds until cached genres are stale, None -> never
+    :return: None
+    """
+    global CACHE_PATH, ENABLED, GENRES_TTL, _connection
+    with _lock:
+        if path is not None and path != CACHE_PATH:
+            if _connection is not None:
+                _connection.close()
+                _connection = None
+            CACHE_PATH = path
+        if enabled is not None:
+            ENABLED = enabled
+        if genres_ttl != -1:
+            GENRES_TTL = genres_ttl
+
+
+def _get_connection():
+    # type: () -> sqlite3.Connection
+    """
+    Open the cache db on first use. Called with _lock held
+    :return: sqlite connection shared by all threads
+    """
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(CACHE_PATH) or '.', exist_ok=True)
+        _connection = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        _connection.execute('CREATE TABLE IF NOT EXISTS track_key (id TEXT PRIMARY KEY, key TEXT)')
+        _connection.execute(
+            'CREATE TABLE IF NOT EXISTS artist_genres (id TEXT PRIMARY KEY, genres TEXT, stored REAL)'
+        )
+        _connection.commit()
+    return _connection
+
+
+def _select(query, ids):
+    # type: (str, list) -> list[tuple]
+    rows = []
+    # Stay under sqlite max variables per statement
+    for i in range(0, len(ids), 500):
+        batch = ids[i:i + 500]
+        placeholders = ','.join('?' * len(batch))
+        rows += _get_connection().execute(query.format(placeholders), batch).fetchall()
+    return rows
+
+
+def get_keys(track_ids):
+    # type: (list) -> dict
+    """
+    Get cached songs keys. Song key never changes, so cached keys never expire
+    :param track_ids: A list of songs ids
+    :return: dict: key: song id, value: song key, only for cached songs
+    """
+    if not ENABLED or not track_ids:
+        return {}
+    with _lock:
+        rows = _select('SELECT id, key FROM track_key WHERE id IN ({})', list(track_ids))
+    return dict(rows)
+
+
+def put_keys(keys):
+    # type: (dict) -> None
+    """
+    Save songs keys
+    :param keys: dict: key: song id, value: song key
+    :return: None
+    """
+    if not ENABLED or not keys:
+        return
+    with _lock:
+        connection = _get_connection()
+        connection.executemany('INSERT OR REPLACE INTO track_key (id, key) VALUES (?, ?)', keys.items())
+        connection.commit()
+
+
+def get_genres(artist_ids):
+    # type: (list) -> dict
+    """
+    Get cached artists genres who are not older than GENRES_TTL
+    :param artist_ids: A list of artists ids
+    :return: dict: key: artist id, value: list of artist genres, only for cached artists
+    """
+    if not ENABLED or not artist_ids:
+        return {}
+    oldest = 0 if GENRES_TTL is None else time.time() - GENRES_TTL
+    with _lock:
+        rows = _select('SELECT id, genres, stored FROM artist_genres WHERE id IN ({})', list(artist_ids))
+    return {artist_id: json.loads(genres) for artist_id, genres, stored in rows if stored >= oldest}
+
+
+def put_genres(genres):
+    # type: (dict) -> None
+    """
+    Save artists genres
+    :param genres: dict: key: artist id, value: list of artist genres
+    :return: None
+    """
+    if not ENABLED or not genres:
+        return
+    now = time.time()
+    with _lock:
+        connection = _get_connection()
+        connection.executemany(
+            'INSERT OR REPLACE INTO artist_genres (id, genres, stored) VALUES (?, ?, ?)',
+            [(artist_id, json.dumps(artist_genres), now) for artist_id, artist_genres in genres.items()]
+        )
+        connection.commit()
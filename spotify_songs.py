@@ -1,22 +1,111 @@
 import json
 import logging
+import queue
+import threading
+from contextlib import closing
 
-import requests
 import spotipy
-from bs4 import BeautifulSoup
-from pymongo import MongoClient
 from spotipy.oauth2 import SpotifyClientCredentials
-from EurovisionStat.winning_eurovision_2019.config import spotify as spotify_config, db
+from EurovisionStat.winning_eurovision_2019 import audio_features, http_client, metrics, parsers, spotify_cache
+from EurovisionStat.winning_eurovision_2019.mongo import BulkWriter, get_client, insert_to_db, notify_write
+from EurovisionStat.winning_eurovision_2019.song_index import SongIndex
+from EurovisionStat.winning_eurovision_2019.config import spotify as spotify_config
 
 LOGGER = logging.getLogger(__name__)
 
-client_credentials_manager = SpotifyClientCredentials(
-        client_id=spotify_config.CLIENT_ID,
-        client_secret=spotify_config.CLIENT_SECRET
-    )
-sp = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+# Max ids per request allowed by Spotify API
+ARTISTS_BATCH_SIZE = 50
+AUDIO_FEATURES_BATCH_SIZE = 100
+PLAYLIST_PAGE_SIZE = 100
+# Max pages/parsed pages waiting between pipeline stages
+QUEUE_SIZE = 2
+# Seconds a blocked background thread waits before checking whether its consumer stopped
+STOP_CHECK_INTERVAL = 0.5
+
+MUSIC_KEYS = {
+    '0': 'C',
+    '1': 'C#',
+    '2': 'D',
+    '3': 'D#',
+    '4': 'E',
+    '5': 'F',
+    '6': 'F#',
+    '7': 'G',
+    '8': 'G#',
+    '9': 'A',
+    '10': 'A#',
+    '11': 'B'
+}
+
+_spotify = None
+_spotify_lock = threading.Lock()
+
+
+def get_spotify():
+    # type: () -> spotipy.Spotify
+    """
+    Get Spotify API client, create it with the configured credentials on first use
+    :return: spotipy.Spotify object
+    """
+    global _spotify
+    with _spotify_lock:
+        if _spotify is None:
+            client_credentials_manager = SpotifyClientCredentials(
+                client_id=spotify_config.CLIENT_ID,
+                client_secret=spotify_config.CLIENT_SECRET
+            )
+            # spotipy retries 429 (honoring Retry-After) and 5xx responses with backoff on its own session
+            _spotify = spotipy.Spotify(
+                client_credentials_manager=client_credentials_manager,
+                requests_timeout=http_client.TIMEOUT,
+                retries=http_client.MAX_RETRIES,
+                status_retries=http_client.MAX_RETRIES,
+                status_forcelist=tuple(http_client.RETRY_STATUSES),
+                backoff_factor=http_client.BACKOFF_BASE
+            )
+        return _spotify
+
+
+def set_spotify(client):
+    # type: (spotipy.Spotify) -> None
+    """
+    Replace Spotify API client, for example with a stub in tests and benchmarks. None -> create on next use
+    :param client: spotipy.Spotify like object or None
+    :return: None
+    """
+    global _spotify
+    with _spotify_lock:
+        _spotify = client
+
 
-mongo_client = MongoClient(f'mongodb://{db.USERNAME}:{db.PASSWORD}@{db.HOST}:{db.PORT}/{db.NAMESPACE}')
+def _chunks(items, size):
+    # type: (list, int) -> list
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def get_artists_genres(artist_ids):
+    # type: (list) -> dict
+    """
+    Get genres of many artists from Spotify API, ARTISTS_BATCH_SIZE artists per request.
+    Each artist is requested once, even if it appears many times, and artists found in spotify_cache are not requested
+    :param artist_ids: A list of artists ids
+    :return: dict: key: artist id, value: list of artist genres
+    """
+    unique_ids = list(dict.fromkeys(artist_ids))
+    genres = spotify_cache.get_genres(unique_ids)
+    missing_ids = [artist_id for artist_id in unique_ids if artist_id not in genres]
+    fetched = {}
+    for batch in _chunks(missing_ids, ARTISTS_BATCH_SIZE):
+        LOGGER.info(f"Get genres of {len(batch)} artists")
+        with metrics.timer('spotify.artists'):
+            artists = get_spotify().artists(batch)['artists']
+        for artist_data in artists:
+            if artist_data is not None:
+                fetched[artist_data['id']] = artist_data['genres']
+    spotify_cache.put_genres(fetched)
+    genres.update(fetched)
+    return genres
 
 
 def get_genres(artists):
@@ -26,32 +115,61 @@ def get_genres(artists):
     :param artists: A list of artists
     :return: A list of artists genres
     """
-    genres = []
-    for artist in artists:
-        artist_data = sp.artist(artist["id"])
-        genre = artist_data['genres']
-        genres.append(genre)
-    return genres
+    genres = get_artists_genres([artist['id'] for artist in artists])
+    return [genres.get(artist['id'], []) for artist in artists]
 
 
+def get_songs_keys(track_ids):
+    # type: (list) -> dict
+    """
+    Get key name of many songs from Spotify audio features API, AUDIO_FEATURES_BATCH_SIZE songs per request.
+    All the audio features are kept in the audio_features store.
+    Songs found in spotify_cache and in the store are not requested
+    :param track_ids: A list of songs ids
+    :return: dict: key: song id, value: song key represented as string, None if Spotify has no key for the song
+    """
+    unique_ids = list(dict.fromkeys(track_ids))
+    keys = spotify_cache.get_keys(unique_ids)
+    store = audio_features.get_store()
+    # Songs without features on Spotify are cached with None key and never stored
+    missing_ids = [track_id for track_id in unique_ids
+                   if track_id not in keys or (keys[track_id] is not None and track_id not in store)]
+    fetched = {}
+    for batch in _chunks(missing_ids, AUDIO_FEATURES_BATCH_SIZE):
+        LOGGER.info(f"Get audio features of {len(batch)} songs")
+        with metrics.timer('spotify.audio_features'):
+            batch_features = get_spotify().audio_features(batch)
+        store.add_many(features for features in batch_features if features)
+        for track_id, features in zip(batch, batch_features):
+            fetched[track_id] = MUSIC_KEYS.get(str(features['key'])) if features else None
+    spotify_cache.put_keys(fetched)
+    keys.update(fetched)
+    return keys
+
+
+@metrics.timed()
 def parse_songs(all_songs):
     # type: (list) -> list
     """
-    Get all eurovision songs from spotify API and takes only wanted parameters
+    Get all eurovision songs from spotify API and takes only wanted parameters.
+    Keys and genres are fetched in batches for all songs together
     :param all_songs: List of songs from spotify API
     :return: List of parsed songs
     """
     LOGGER.info(f"Get all songs from playlist")
+    # Removed or local playlist items have no track
+    tracks = [song['track'] for song in all_songs if song.get('track') and song['track'].get('id')]
+    keys = get_songs_keys([track['id'] for track in tracks])
+    genres = get_artists_genres([artist['id'] for track in tracks for artist in track['artists']])
     song_list = []
-    for song in all_songs:
-        track = song['track']
+    for track in tracks:
         new_song = {
             'name': track['name'],
             'id': track['id'],
             'artist': [artist['name'] for artist in track['artists']],
             'date': track['album']['release_date'],
-            'key': get_song_key(track),
-            'genres': get_genres(track['artists'])
+            'key': keys[track['id']],
+            'genres': [genres.get(artist['id'], []) for artist in track['artists']]
         }
         song_list.append(new_song)
     return song_list
@@ -73,44 +191,26 @@ def get_song_key(song):
     :return: Song key represented as string
     """
     LOGGER.info(f"Get song key. song: {song['name']}")
-    analysis = sp.audio_analysis(song['id'])
-    music_keys = {
-        '0': 'C',
-        '1': 'C#',
-        '2': 'D',
-        '3': 'D#',
-        '4': 'E',
-        '5': 'F',
-        '6': 'F#',
-        '7': 'G',
-        '8': 'G#',
-        '9': 'A',
-        '10': 'A#',
-        '11': 'B'
-    }
-    music_key = str(analysis['track']['key'])
-    return music_keys[music_key]
-
-
-def insert_to_db(client, documents, collection_name):
-    """
-    Insert document or list of document (dict or JSON) to db
-    :param client: Mongo client
-    :param collection_name: collection to store the documens
-    :param documents: dict or list of dicts who represent wikipedia table
-    :return: None
-    :raise: TypeError if documents not in correct type (dict or list)
+    return get_songs_keys([song['id']])[song['id']]
+
+
+def nearest_winners(track_ids, k=5):
+    # type: (list, int) -> dict
+    """
+    Find the past winners who sound the most like every candidate track, e.g. a whole season entries.
+    Audio features of candidates who are not in the store are downloaded in batches
+    :param track_ids: Spotify ids of the candidate tracks
+    :param k: number of winners per candidate
+    :return: dict: key: candidate id, value: list of (winner song name, similarity) pairs, most similar first
     """
-    eurovision_db = client.eurovision
-    LOGGER.info(f"Insert document to collection: {collection_name}")
-    if type(documents) is dict:
-        documents = [documents]
-    if type(documents) is list:
-        for doc in documents:
-            collection = eurovision_db[collection_name]
-            collection.insert_one(doc)
-    else:
-        raise TypeError
+    store = audio_features.get_store()
+    winners = {doc['id']: doc['name'] for doc in get_client().eurovision['winners_songs_spotify'].find(
+        {}, {'_id': 0, 'id': 1, 'name': 1})}
+    get_songs_keys([track_id for track_id in list(track_ids) + list(winners) if track_id not in store])
+    candidates = [track_id for track_id in track_ids if track_id in store]
+    matches = store.nearest_winners(candidates, k=k, winner_ids=[track_id for track_id in winners if track_id in store])
+    return {track_id: [(winners[winner_id], similarity) for winner_id, similarity in candidate_matches]
+            for track_id, candidate_matches in zip(candidates, matches)}
 
 
 def get_song_number_in_final():
@@ -120,66 +220,175 @@ def get_song_number_in_final():
     """
     url = 'https://eschome.net/databaseoutput202.php'
     headers = {'content-type': 'application/x-www-form-urlencoded'}
-    result = requests.post(url, headers=headers)
-    bs = BeautifulSoup(result.text, 'html.parser')
-    table = bs.find("table", {"id": "tabelle1"})
-    rows = table.find_all('tr')
+    result = http_client.post(url, headers=headers, is_valid=lambda content: b'tabelle1' in content)
+    rows = parsers.table_rows(result, 'tabelle1')
     songs_numbers = {}
-    for row in rows[1:]:
-        _song_name = row.find_all('td')[6]
-        song_number = row.find_all('td')[2]
-        songs_numbers[_song_name.text.replace('.', '').replace(',', '')] = song_number.text
-    insert_to_db(mongo_client, songs_numbers, 'winner_songs_perform_number')
+    if rows is None:
+        LOGGER.warning(f"Songs numbers table is missing. url: {url}")
+        rows = []
+    for td in rows[1:]:
+        _song_name = td[6]
+        song_number = td[2]
+        songs_numbers[_song_name.replace('.', '').replace(',', '')] = song_number
+    insert_to_db(get_client(), songs_numbers, 'winner_songs_perform_number')
     return songs_numbers
 
 
 def merge_collections():
     """
-    Merge winner by year collection with spotify song data and update it in db
+    Merge the wikipedia winners by year table with spotify song data and store the winners in winners_by_year,
+    one document per year. Documents are upserted on year, so a rerun replaces them instead of duplicate.
+    Each bound winner keeps the match confidence, winners without a good enough match are logged
     :return: None
     """
-    eurovision_db = mongo_client.eurovision
-    winner_by_year_collection = eurovision_db['winners_by_year'].find_one()
-    for key in winner_by_year_collection:
-        try:
-            song_name = winner_by_year_collection[key]['song']
-            spotify_songs = eurovision_db['winners_songs_spotify'].find()
-            for doc in spotify_songs:
-                if doc['name'] in song_name:
-                    winner_by_year_collection[key]['song'] = doc
-                    insert_to_db(mongo_client, winner_by_year_collection[key], 'winners_by_year')
-                    break
-        except Exception as e:
-            pass
+    eurovision_db = get_client().eurovision
+    winners_table = eurovision_db['wikipedia'].find_one({'_id': 'by_year'}, {'_id': 0}) or {}
+    songs_index = SongIndex.from_collection(eurovision_db['winners_songs_spotify'])
+    merged = []
+    for year, winner in winners_table.items():
+        if not isinstance(winner, dict) or not isinstance(winner.get('song'), str):
+            continue
+        song, confidence = songs_index.bind(winner['song'])
+        if song is not None:
+            winner['year'] = year
+            winner['song'] = song
+            winner['song_match_confidence'] = confidence
+            merged.append(winner)
+    insert_to_db(get_client(), merged, 'winners_by_year', upsert_keys=('year',))
 
 
+@metrics.timed()
 def extract_winner_from_country():
     """
-    Build winner by location from existing "winners by year" collection
-    :return: dict with all winners by location of the competition
+    Build winner by location from existing "winners by year" collection.
+    Winners are grouped on the server into all_winners_by_location, one document per location:
+    {'_id': location (lower case, without spaces), 'wins': count, 'winners': [winner documents, oldest first]}.
+    Winners without host city are not grouped, the host_city index is created by schema.bootstrap.
+    Requires MongoDB 4.4+ ($replaceAll)
+    :return: cursor over the location documents
     """
-    eurovision_db = mongo_client.eurovision
-    all_winning_by_location = {}
-    winner_by_year_collection = eurovision_db['winners_by_year'].find()
-    for doc in winner_by_year_collection:
-        location = ''
+    eurovision_db = get_client().eurovision
+    winners_by_year = eurovision_db['winners_by_year']
+    location = {'$toLower': {'$replaceAll': {'input': '$host_city', 'find': ' ', 'replacement': ''}}}
+    pipeline = [
+        {'$match': {'host_city': {'$type': 'string'}}},
+        {'$sort': {'year': 1}},
+        {'$project': {'_id': 0, 'song._id': 0}},
+        {'$group': {'_id': location, 'wins': {'$sum': 1}, 'winners': {'$push': '$$ROOT'}}},
+        {'$out': 'all_winners_by_location'}
+    ]
+    LOGGER.info(f"Group winners by location")
+    winners_by_year.aggregate(pipeline, allowDiskUse=True)
+    notify_write('all_winners_by_location')
+    return eurovision_db['all_winners_by_location'].find()
+
+
+_DONE = object()
+
+
+def _in_thread(items, queue_size=QUEUE_SIZE):
+    # type: (iter, int) -> iter
+    """
+    Consume iterable in a background thread, hand its items over a bounded queue.
+    The thread runs ahead by at most queue_size items, so the next item is prepared while the current one is used.
+    When the returned generator is closed (or garbage collected) before the end, the thread stops too
+    :param items: iterable to consume
+    :param queue_size: max items waiting in the queue
+    :return: generator of the iterable items
+    """
+    items_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        # type: (object) -> bool
+        while not stop.is_set():
+            try:
+                items_queue.put(item, timeout=STOP_CHECK_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
         try:
-            location = doc['host_city'].replace(' ', '').lower()
-            doc.pop('_id', None)
-            doc["song"].pop('_id', None)
-            all_winning_by_location[location].append(doc)
-        except KeyError:
-            all_winning_by_location[location] = [doc]
-    insert_to_db(mongo_client, all_winning_by_location, 'all_winners_by_location')
-    return all_winning_by_location
+            for item in items:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(_DONE)
 
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = items_queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
 
-def workflow():
+
+def iter_playlist_pages(user, playlist_id, page_size=PLAYLIST_PAGE_SIZE):
+    # type: (str, str, int) -> iter
+    """
+    Get all playlist items page by page, following the "next" link of every page
+    :param user: playlist owner
+    :param playlist_id: Spotify playlist id
+    :param page_size: items per page
+    :return: generator of pages, each page is a list of playlist items
+    """
+    with metrics.timer('spotify.playlist_tracks'):
+        page = get_spotify().user_playlist_tracks(user=user, playlist_id=playlist_id, limit=page_size)
+    while page:
+        LOGGER.info(f"Got playlist page. offset: {page['offset']}, total: {page['total']}")
+        yield page['items']
+        if not page['next']:
+            return
+        with metrics.timer('spotify.playlist_tracks'):
+            page = get_spotify().next(page)
+
+
+def iter_playlist_songs(user, playlist_id, page_size=PLAYLIST_PAGE_SIZE, skip_ids=()):
+    # type: (str, str, int, set) -> iter
+    """
+    Stream parsed songs of a playlist.
+    Download and parsing run in separate threads connected by bounded queues,
+    so the next page is downloaded while the current one is parsed and memory use does not grow with playlist size
+    :param user: playlist owner
+    :param playlist_id: Spotify playlist id
+    :param page_size: items per page
+    :param skip_ids: ids of songs who are not parsed, for example songs who are already stored
+    :return: generator of parsed songs lists, one list per page
+    """
+    pages = _in_thread(iter_playlist_pages(user, playlist_id, page_size))
+    if skip_ids:
+        pages = ([item for item in items if (item.get('track') or {}).get('id') not in skip_ids] for items in pages)
+    return _in_thread(parse_songs(items) for items in pages)
+
+
+def workflow(incremental=False):
+    # type: (bool) -> int
+    """
+    Download all songs of eurovision playlist from spotify and store them in db.
+    Songs are identified by Spotify id, so a rerun updates them instead of duplicate
+    :param incremental: True -> get data only for songs who are not stored yet or marked with 'stale': True
+    :return: number of stored songs
+    """
     LOGGER.info(f"Start downloading songs from spotify.")
-    playlist = sp.user_playlist_tracks(
+    collection = get_client().eurovision['winners_songs_spotify']
+    stored_ids = set(collection.distinct('id', {'stale': {'$ne': True}})) if incremental else set()
+    songs = iter_playlist_songs(
         user=spotify_config.EUROVISION_PLYLIST_USER,
-        playlist_id=spotify_config.EUROVISION_PLAYLIST_ID
+        playlist_id=spotify_config.EUROVISION_PLAYLIST_ID,
+        skip_ids=stored_ids
     )
-    songs = parse_songs(playlist['items'])
-    return songs
-
+    # Closed on error too, so the download and parse threads don't wait for a consumer who is gone
+    with closing(songs), BulkWriter(get_client(), 'winners_songs_spotify', upsert_keys=('id',)) as writer:
+        for page_songs in songs:
+            writer.add_many(page_songs)
+    audio_features.get_store().save()
+    return writer.written
@@ -0,0 +1,374 @@
+"""
+Read only HTTP API over the computed statistics, built on asyncio streams.
+Results are cached in process (LRU with TTL), entries are dropped as soon as this process writes to the
+collections they were read from, writes of other processes are seen after TTL.
+Responses carry an ETag, requests with a matching If-None-Match get 304 without a body.
+Run: python -m EurovisionStat.winning_eurovision_2019.stats_server [--port 8080] [--mongo-uri URI]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from pymongo import MongoClient
+from EurovisionStat.winning_eurovision_2019 import mongo, votes
+
+LOGGER = logging.getLogger(__name__)
+
+CACHE_SIZE = 1024
+# Seconds a cached result is served, bounds staleness when another process writes the data
+CACHE_TTL = 60
+MAX_HEADERS = 100
+# Seconds an idle keep alive connection stays open
+IDLE_TIMEOUT = 30
+
+
+class NotFoundError(Exception):
+    """
+    Raised by route handlers when the requested resource does not exist
+    """
+
+
+class BadRequestError(Exception):
+    """
+    Raised by route handlers on invalid query parameters
+    """
+
+
+class ResultCache(object):
+    """
+    Thread safe LRU cache of encoded responses with TTL.
+    Every entry knows the collections it was read from, and is dropped when one of them is written.
+    Every write bumps the collection generation, a result read before a write is not cached
+    """
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+        # type: (int, float) -> None
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        # type: (str) -> tuple
+        """
+        Get cached response
+        :param key: request path and query
+        :return: (etag, body) tuple, None if not cached or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2], entry[3]
+
+    def generation(self, collections):
+        # type: (tuple) -> tuple
+        """
+        Get write generation of collections, taken before a query and given to put with its result
+        :param collections: collection names
+        :return: tuple of write counts
+        """
+        with self._lock:
+            return tuple(self._generations.get(collection_name, 0) for collection_name in collections)
+
+    def put(self, key, collections, etag, body, generation=None):
+        # type: (str, tuple, str, bytes, tuple) -> None
+        """
+        Cache response
+        :param key: request path and query
+        :param collections: collections the response was read from
+        :param etag: response ETag
+        :param body: response body
+        :param generation: collections generation taken before the query, None -> always cache
+        :return: None
+        """
+        with self._lock:
+            current = tuple(self._generations.get(collection_name, 0) for collection_name in collections)
+            if generation is not None and generation != current:
+                # A collection was written while the query ran, the result may be stale
+                return
+            self._entries[key] = (time.monotonic(), tuple(collections), etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, collection_name):
+        # type: (str) -> None
+        """
+        Drop entries read from the collection, registered as mongo write listener
+        :param collection_name: written collection
+        :return: None
+        """
+        with self._lock:
+            self._generations[collection_name] = self._generations.get(collection_name, 0) + 1
+            stale = [key for key, entry in self._entries.items() if collection_name in entry[1]]
+            for key in stale:
+                del self._entries[key]
+        if stale:
+            LOGGER.debug(f"Invalidated cached results. collection: {collection_name}, entries: {len(stale)}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _latest(collection_name):
+    # type: (str) -> dict
+    document = mongo.get_client().eurovision[collection_name].find_one({}, {'_id': 0}, sort=[('_id', -1)])
+    if document is None:
+        raise NotFoundError(collection_name)
+    return document
+
+
+def songs_statistics(query):
+    return _latest('songs_statistic')
+
+
+def best_friends(query):
+    return _latest('bff')
+
+
+def winners(query):
+    document = mongo.get_client().eurovision['winner_by_year_new'].find_one({'_id': 'winners'}, {'_id': 0})
+    if document is None:
+        raise NotFoundError('winner_by_year_new')
+    return document
+
+
+def winners_by_location(query, location=None):
+    collection = mongo.get_client().eurovision['all_winners_by_location']
+    if location is not None:
+        document = collection.find_one({'_id': location.replace(' ', '').lower()})
+        if document is None:
+            raise NotFoundError(location)
+        return document
+    return {doc['_id']: doc['winners'] for doc in collection.find()}
+
+
+def _int_parameter(query, name, default):
+    # type: (dict, str, int) -> int
+    try:
+        return int(query[name][0]) if name in query else default
+    except ValueError:
+        raise BadRequestError(f"{name} must be an integer")
+
+
+def votes_query(query):
+    """
+    Votes records, query parameters: country (repeatable), year, year_from, year_to, direction (from / to)
+    """
+    direction = query.get('direction', ['from'])[0]
+    if direction not in ('from', 'to'):
+        raise BadRequestError("direction must be from or to")
+    year = _int_parameter(query, 'year', None)
+    year_from = _int_parameter(query, 'year_from', year or votes.FIRST_YEAR)
+    year_to = _int_parameter(query, 'year_to', year or votes.LAST_YEAR)
+    records = votes.iter_votes(query.get('country'), year_from, year_to, from_country=direction == 'from')
+    return {'direction': direction, 'votes': [list(record) for record in records]}
+
+
+# path -> (handler, collections the result is read from, True if the path takes an argument: /path/<argument>),
+# handler gets the parsed query string and the argument
+ROUTES = {
+    '/songs-statistics': (songs_statistics, ('songs_statistic',), False),
+    '/best-friends': (best_friends, ('bff',), False),
+    '/winners': (winners, ('winner_by_year_new',), False),
+    '/winners-by-location': (winners_by_location, ('all_winners_by_location',), True),
+    '/votes': (votes_query, ('points_by_year_given_from', 'points_by_year_given_to'), False),
+}
+
+
+class StatsServer(object):
+    """
+    Asyncio HTTP/1.1 server of ROUTES with keep alive. Mongo queries run in the default thread pool,
+    concurrent requests of the same uncached resource share one query
+    """
+
+    def __init__(self, host='127.0.0.1', port=8080, cache=None):
+        # type: (str, int, ResultCache) -> None
+        self.host = host
+        self.port = port
+        self.cache = cache or ResultCache()
+        self._in_flight = {}
+        self._server = None
+
+    async def start(self):
+        """
+        Start listening, port 0 picks a free port who is set on self.port
+        :return: None
+        """
+        mongo.add_write_listener(self.cache.invalidate)
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        LOGGER.info(f"Stats server is listening. url: http://{self.host}:{self.port}")
+
+    async def close(self):
+        mongo.remove_write_listener(self.cache.invalidate)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                headers = {}
+                for _ in range(MAX_HEADERS):
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status, response_headers, body = await self._respond(request_line, headers)
+                response_headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+                response_headers['Content-Length'] = str(len(body))
+                head = f'HTTP/1.1 {status.value} {status.phrase}\r\n' + ''.join(
+                    f'{name}: {value}\r\n' for name, value in response_headers.items()) + '\r\n'
+                writer.write(head.encode('latin-1') + (b'' if request_line.startswith(b'HEAD') else body))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, request_line, headers):
+        # type: (bytes, dict) -> tuple
+        """
+        Build response of one request
+        :return: (HTTPStatus, headers dict, body) tuple
+        """
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            return self._error(HTTPStatus.BAD_REQUEST, 'Malformed request line')
+        if method not in ('GET', 'HEAD'):
+            return self._error(HTTPStatus.METHOD_NOT_ALLOWED, 'Read only API', {'Allow': 'GET, HEAD'})
+        url = urlsplit(target)
+        path = unquote(url.path).rstrip('/') or '/'
+        if path == '/health':
+            return self._json(HTTPStatus.OK, {'status': 'ok', 'cached': len(self.cache),
+                                              'hits': self.cache.hits, 'misses': self.cache.misses})
+        route, argument = path, None
+        if route not in ROUTES and route.count('/') == 2:
+            route, argument = route.rsplit('/', 1)
+        if route not in ROUTES or (argument is not None and not ROUTES[route][2]):
+            return self._error(HTTPStatus.NOT_FOUND, f'Unknown path: {path}')
+        key = f'{path}?{url.query}'
+        cached = self.cache.get(key)
+        if cached is None:
+            try:
+                cached = await self._load(key, route, argument, parse_qs(url.query))
+            except NotFoundError as e:
+                return self._error(HTTPStatus.NOT_FOUND, f'Not found: {e}')
+            except BadRequestError as e:
+                return self._error(HTTPStatus.BAD_REQUEST, str(e))
+            except Exception as e:
+                LOGGER.exception(f"Request failed. path: {path}")
+                return self._error(HTTPStatus.INTERNAL_SERVER_ERROR, repr(e))
+        etag, body = cached
+        response_headers = {'ETag': etag, 'Cache-Control': 'max-age=0, must-revalidate'}
+        if etag in (tag.strip() for tag in headers.get('if-none-match', '').split(',')):
+            return HTTPStatus.NOT_MODIFIED, response_headers, b''
+        response_headers['Content-Type'] = 'application/json'
+        return HTTPStatus.OK, response_headers, body
+
+    async def _load(self, key, route, argument, query):
+        # type: (str, str, str, dict) -> tuple
+        """
+        Query the result in the thread pool and cache it. A second request of the same key waits for the first query
+        :return: (etag, body) tuple
+        """
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            return await asyncio.shield(in_flight)
+        handler, collections, _ = ROUTES[route]
+        arguments = (query,) if argument is None else (query, argument)
+        generation = self.cache.generation(collections)
+
+        def query_and_encode():
+            body = json.dumps(handler(*arguments), default=str, sort_keys=True).encode('utf-8')
+            return f'"{hashlib.sha1(body).hexdigest()}"', body
+
+        future = asyncio.get_running_loop().run_in_executor(None, query_and_encode)
+        self._in_flight[key] = future
+        try:
+            etag, body = await future
+        finally:
+            del self._in_flight[key]
+        self.cache.put(key, collections, etag, body, generation)
+        return etag, body
+
+    @staticmethod
+    def _json(status, content, headers=None):
+        # type: (HTTPStatus, dict, dict) -> tuple
+        return status, dict(headers or {}, **{'Content-Type': 'application/json'}), json.dumps(content).encode('utf-8')
+
+    def _error(self, status, message, headers=None):
+        # type: (HTTPStatus, str, dict) -> tuple
+        return self._json(status, {'error': message}, headers)
+
+
+def serve(host='127.0.0.1', port=8080, cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL):
+    # type: (str, int, int, float) -> None
+    """
+    Run stats server until interrupted
+    :param host: listen address
+    :param port: listen port
+    :param cache_size: max cached results
+    :param cache_ttl: seconds a cached result is served
+    :return: None
+    """
+    server = StatsServer(host, port, ResultCache(cache_size, cache_ttl))
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        LOGGER.info(f"Stats server stopped")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Read only HTTP API over the computed statistics')
+    parser.add_argument('--host', default='127.0.0.1', help='listen address')
+    parser.add_argument('--port', type=int, default=8080, help='listen port')
+    parser.add_argument('--mongo-uri', help='Mongo uri, e.g. mongodb://localhost, default: configured db')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help='max cached results')
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL, help='seconds a cached result is served')
+    arguments = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if arguments.mongo_uri:
+        mongo.set_client(MongoClient(arguments.mongo_uri))
+    serve(arguments.host, arguments.port, arguments.cache_size, arguments.cache_ttl)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Task(object):
+    """
+    Named unit of work who runs after the tasks it requires
+    """
+
+    def __init__(self, name, function, requires=()):
+        # type: (str, callable, tuple) -> None
+        """
+        :param name: task name
+        :param function: callable without arguments
+        :param requires: names of tasks who must finish before this task starts
+        """
+        self.name = name
+        self.function = function
+        self.requires = tuple(requires)
+
+    def __repr__(self):
+        return f'Task({self.name!r}, requires={self.requires!r})'
+
+
+class TaskFailedError(Exception):
+    """
+    Raised when a task raised, after the running tasks finished
+    """
+
+
+def with_requirements(tasks, names):
+    # type: (dict, iter) -> list[str]
+    """
+    Add all the tasks the given tasks require, directly or indirectly
+    :param tasks: dict: key: task name, value: Task
+    :param names: wanted task names
+    :return: list of task names
+    """
+    selected = []
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.append(name)
+            pending.extend(tasks[name].requires)
+    return [name for name in tasks if name in selected]
+
+
+def _check(tasks):
+    # type: (dict) -> None
+    """
+    Validate task graph
+    :raise: ValueError if a requirement is unknown or the graph has a cycle
+    """
+    for task in tasks.values():
+        for required in task.requires:
+            if required not in tasks:
+                raise ValueError(f"Task {task.name} requires unknown task {required}")
+    visited = set()
+    visiting = set()
+
+    def visit(name):
+        if name in visiting:
+            raise ValueError(f"Tasks cycle through {name}")
+        if name not in visited:
+            visiting.add(name)
+            for required in tasks[name].requires:
+                visit(required)
+            visiting.remove(name)
+            visited.add(name)
+
+    for name in tasks:
+        visit(name)
+
+
+def run(tasks, names=None, max_workers=4):
+    # type: (dict, list, int) -> dict
+    """
+    Run tasks in parallel - every task starts as soon as the tasks it requires are done.
+    Requirements who are not selected are treated as done
+    :param tasks: dict: key: task name, value: Task
+    :param names: names of tasks to run, None -> all tasks
+    :param max_workers: max tasks running at the same time
+    :return: dict: key: task name, value: task wall time in seconds
+    :raise: ValueError if a task is unknown or the graph is invalid
+    :raise: TaskFailedError if a task raised, tasks who require it are not started
+    """
+    _check(tasks)
+    names = list(tasks) if names is None else list(names)
+    for name in names:
+        if name not in tasks:
+            raise ValueError(f"Unknown task: {name}")
+    waiting = {name: {required for required in tasks[name].requires if required in names} for name in names}
+    timings = {}
+    failed = {}
+    running = {}
+    started = time.monotonic()
+
+    def timed(task):
+        task_started = time.monotonic()
+        LOGGER.info(f"Start task: {task.name}")
+        try:
+            task.function()
+        finally:
+            timings[task.name] = time.monotonic() - task_started
+            LOGGER.info(f"Finished task: {task.name}. wall time: {timings[task.name]:.2f}s")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while waiting or running:
+            if not failed:
+                for name in [name for name, requires in waiting.items() if not requires]:
+                    del waiting[name]
+                    running[executor.submit(timed, tasks[name])] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                if future.exception() is not None:
+                    LOGGER.error(f"Task failed: {name}. error: {future.exception()!r}")
+                    failed[name] = future.exception()
+                    continue
+                for requires in waiting.values():
+                    requires.discard(name)
+    LOGGER.info(f"Tasks wall time: {time.monotonic() - started:.2f}s")
+    for name in names:
+        if name in timings:
+            LOGGER.info(f"  {name:<30}{timings[name]:10.2f}s")
+    if failed:
+        raise TaskFailedError(f"Failed tasks: {', '.join(failed)}, not started: {', '.join(waiting)}") \
+            from next(iter(failed.values()))
+    return timings
@@ -0,0 +1,17 @@
+import mongomock
+import pytest
+
+from EurovisionStat.winning_eurovision_2019 import countries, mongo
+
+
+@pytest.fixture
+def client():
+    """
+    mongomock client set as the process wide client, with an empty countries registry loaded from it
+    """
+    client = mongomock.MongoClient()
+    mongo.set_client(client)
+    countries.set_registry(None)
+    yield client
+    countries.set_registry(None)
+    mongo.set_client(None)
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from EurovisionStat.winning_eurovision_2019 import http_cache, http_client
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(http_cache, 'CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(http_cache, 'ENABLED', True)
+    monkeypatch.setattr(http_cache, 'OFFLINE', False)
+    monkeypatch.setattr(http_cache, 'TTL', 60)
+    monkeypatch.setattr(http_cache, 'MAX_SIZE', 1024 * 1024)
+    monkeypatch.setattr(http_cache, '_total_size', None)
+
+
+def _store(url, body=b'page'):
+    key = http_cache.make_key('GET', url)
+    http_cache.store(key, url, body)
+    return key
+
+
+def test_key_ignores_payload_order():
+    assert http_cache.make_key('post', 'u', {'a': 1, 'b': 2}) == http_cache.make_key('POST', 'u', {'b': 2, 'a': 1})
+    assert http_cache.make_key('POST', 'u', {'a': 1}) != http_cache.make_key('POST', 'u', {'a': 2})
+
+
+def test_stale_entries_are_not_served(monkeypatch):
+    key = _store('http://a')
+    assert http_cache.load(key) == b'page'
+    now = http_cache.time.time()
+    monkeypatch.setattr(http_cache.time, 'time', lambda: now + 61)
+    assert http_cache.load(key) is None
+    assert http_cache.load(key, ttl=None) == b'page'
+    assert http_cache.load(key, ttl=120) == b'page'
+
+
+def test_least_recently_used_entries_are_evicted(monkeypatch):
+    keys = [_store(f'http://{i}', os.urandom(1000)) for i in range(3)]
+    for i, key in enumerate(keys):
+        os.utime(http_cache._path(key), (i, i))
+    # Loading touches the oldest entry, so the second one is evicted first
+    assert http_cache.load(keys[0]) is not None
+    entry_size = os.path.getsize(http_cache._path(keys[0]))
+    monkeypatch.setattr(http_cache, 'MAX_SIZE', entry_size * 3)
+    _store('http://3', os.urandom(1000))
+    assert [http_cache.load(key) is not None for key in keys] == [True, False, True]
+
+
+def test_offline_serves_stale_entries_and_raises_on_miss(monkeypatch):
+    key = _store('http://a')
+    monkeypatch.setattr(http_cache, 'OFFLINE', True)
+    now = http_cache.time.time()
+    monkeypatch.setattr(http_cache.time, 'time', lambda: now + 3600)
+    assert http_client.get('http://a') == b'page'
+    monkeypatch.setattr(http_client, 'get_session', lambda: pytest.fail('request sent in offline mode'))
+    with pytest.raises(http_cache.CacheMissError):
+        http_client.get('http://b')
+    assert http_cache.load(key) == b'page'
+
+
+def test_disabled_cache_is_not_used():
+    key = _store('http://a')
+    http_cache.configure(enabled=False)
+    assert http_cache.load(key) is None
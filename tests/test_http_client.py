@@ -0,0 +1,110 @@
+import pytest
+import requests
+
+from EurovisionStat.winning_eurovision_2019 import http_cache, http_client
+from EurovisionStat.winning_eurovision_2019.http_client import InvalidResponseError, TokenBucket
+
+URL = 'http://eschome.test/votes'
+
+
+def _response(status=200, body=b'ok', headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.headers.update(headers or {})
+    response.url = URL
+    return response
+
+
+class FakeSession(object):
+    """
+    Session who answers requests with the queued responses, exceptions in the queue are raised
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        response = self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(http_client.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(http_client, '_limiters', {})
+    monkeypatch.setattr(http_cache, 'ENABLED', False)
+    monkeypatch.setattr(http_client, 'MAX_RETRIES', 2)
+    return sleeps
+
+
+def _use(monkeypatch, session):
+    monkeypatch.setattr(http_client, 'get_session', lambda: session)
+    return session
+
+
+def test_transient_failures_are_retried(monkeypatch, sleeps):
+    session = _use(monkeypatch, FakeSession(requests.ConnectionError(), _response(503), _response(body=b'votes')))
+    assert http_client.get(URL) == b'votes'
+    assert session.calls == 3
+    assert len(sleeps) == 2
+
+
+def test_retry_after_pauses_the_host(monkeypatch, sleeps):
+    _use(monkeypatch, FakeSession(_response(429, headers={'Retry-After': '7'}), _response()))
+    assert http_client.get(URL) == b'ok'
+    assert sleeps[0] == 7
+    # The next request of any thread waits for the pause too
+    assert len(sleeps) == 2 and 6 < sleeps[1] <= 7
+
+
+def test_retry_after_values():
+    assert http_client.retry_after(_response(429, headers={'Retry-After': '1000'})) == http_client.RETRY_AFTER_MAX
+    assert http_client.retry_after(_response(429, headers={'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})) == 0
+    assert http_client.retry_after(_response(429, headers={'Retry-After': 'soon'})) is None
+    assert http_client.retry_after(_response(429)) is None
+
+
+def test_last_error_status_is_raised(monkeypatch, sleeps):
+    session = _use(monkeypatch, FakeSession(_response(503)))
+    with pytest.raises(requests.HTTPError):
+        http_client.get(URL)
+    assert session.calls == http_client.MAX_RETRIES + 1
+
+
+def test_last_connection_error_is_raised(monkeypatch, sleeps):
+    _use(monkeypatch, FakeSession(requests.ConnectionError()))
+    with pytest.raises(requests.ConnectionError):
+        http_client.get(URL)
+
+
+def test_invalid_body_is_retried_then_raised(monkeypatch, sleeps):
+    session = _use(monkeypatch, FakeSession(_response(body=b'throttled')))
+    with pytest.raises(InvalidResponseError):
+        http_client.post(URL, is_valid=lambda content: b'tabelle1' in content)
+    assert session.calls == http_client.MAX_RETRIES + 1
+
+
+def test_token_bucket_spaces_requests(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(http_client.time, 'sleep', sleeps.append)
+    bucket = TokenBucket(rate=10, burst=2)
+    for _ in range(4):
+        bucket.wait()
+    # Burst goes at once, then every caller waits for its token in order
+    assert sleeps == [pytest.approx(0.1, abs=0.01), pytest.approx(0.2, abs=0.01)]
+
+
+def test_token_bucket_without_rate_only_pauses(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(http_client.time, 'sleep', sleeps.append)
+    bucket = TokenBucket()
+    bucket.wait()
+    bucket.pause(3)
+    bucket.wait()
+    assert len(sleeps) == 1 and 2.9 < sleeps[0] <= 3
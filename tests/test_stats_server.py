@@ -0,0 +1,59 @@
+import asyncio
+import json
+from http import HTTPStatus
+
+import pytest
+
+from EurovisionStat.winning_eurovision_2019 import mongo
+from EurovisionStat.winning_eurovision_2019.stats_server import ResultCache, StatsServer
+
+
+@pytest.fixture
+def server(client):
+    client.eurovision['bff'].insert_one({'1': ['a', 'b']})
+    client.eurovision['all_winners_by_location'].insert_one({'_id': 'telaviv', 'winners': [2019]})
+    server = StatsServer(cache=ResultCache())
+    mongo.add_write_listener(server.cache.invalidate)
+    yield server
+    mongo.remove_write_listener(server.cache.invalidate)
+
+
+def _get(server, path, headers=None):
+    status, response_headers, body = asyncio.run(server._respond(f'GET {path} HTTP/1.1\r\n'.encode(), headers or {}))
+    return status, response_headers, json.loads(body) if body else None
+
+
+def test_routes(server):
+    assert _get(server, '/best-friends')[2] == {'1': ['a', 'b']}
+    assert _get(server, '/winners-by-location')[2] == {'telaviv': [2019]}
+    assert _get(server, '/winners-by-location/Tel%20Aviv')[2]['winners'] == [2019]
+    assert _get(server, '/winners-by-location/Paris')[0] == HTTPStatus.NOT_FOUND
+
+
+@pytest.mark.parametrize('path', ['/nope', '/best-friends/x', '/votes/Israel', '/winners-by-location/a/b'])
+def test_unknown_paths_are_not_found(server, path):
+    assert _get(server, path)[0] == HTTPStatus.NOT_FOUND
+
+
+def test_matching_etag_is_not_modified(server):
+    status, headers, _ = _get(server, '/best-friends')
+    assert status == HTTPStatus.OK
+    status, _, body = _get(server, '/best-friends', {'if-none-match': headers['ETag']})
+    assert status == HTTPStatus.NOT_MODIFIED
+    assert body is None
+    assert server.cache.hits == 1
+
+
+def test_write_changes_etag(server, client):
+    etag = _get(server, '/best-friends')[1]['ETag']
+    mongo.insert_to_db(client, {'1': ['c', 'd']}, 'bff')
+    status, headers, body = _get(server, '/best-friends', {'if-none-match': etag})
+    assert status == HTTPStatus.OK
+    assert headers['ETag'] != etag
+    assert body == {'1': ['c', 'd']}
+
+
+def test_read_only(server):
+    status, headers, _ = asyncio.run(server._respond(b'POST /bff HTTP/1.1\r\n', {}))
+    assert status == HTTPStatus.METHOD_NOT_ALLOWED
+    assert headers['Allow'] == 'GET, HEAD'
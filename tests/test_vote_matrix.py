@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from EurovisionStat.winning_eurovision_2019 import countries
+from EurovisionStat.winning_eurovision_2019.vote_matrix import VoteMatrix
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    registry = countries.CountryRegistry()
+    for name in ('a', 'b', 'c', 'd'):
+        registry.register(name)
+    countries.set_registry(registry)
+    yield registry
+    countries.set_registry(None)
+
+
+def _matrix(documents):
+    return VoteMatrix.from_documents(documents)
+
+
+def test_countries_without_points_have_no_friends():
+    matrix = _matrix([
+        {'year': 2000, 'country': 'a', 'voted': []},
+        {'year': 2000, 'country': 'b', 'voted': []},
+        {'year': 2000, 'country': 'c', 'voted': [{'country': 'd', 'points': '12'}]},
+        {'year': 2000, 'country': 'd', 'voted': [{'country': 'c', 'points': '10'}]},
+    ])
+    assert matrix.mutual_friends(k=1) == [('c', 'd', 22)]
+    assert matrix.blocs(k=1) == [['c', 'd']]
+    assert matrix.top_friends(k=1)[:, 0].tolist() == [-1, -1, matrix.index('d'), matrix.index('c')]
+
+
+def test_non_participants_are_not_friends():
+    matrix = _matrix([
+        {'year': 2000, 'country': 'a', 'voted': [{'country': 'b', 'points': '12'}]},
+        {'year': 2000, 'country': 'b', 'voted': [{'country': 'a', 'points': '8'}]},
+        {'year': 2001, 'country': 'c', 'voted': [{'country': 'a', 'points': '5'}]},
+    ])
+    top = matrix.top_friends(k=1, year_from=2000, year_to=2000)
+    assert top[matrix.index('c'), 0] == -1
+    assert matrix.mutual_friends(k=1, year_from=2001) == []
+    assert matrix.blocs(k=2, year_from=2001) == []
+
+
+def test_k_is_clamped_to_other_countries():
+    matrix = _matrix([
+        {'year': 2000, 'country': 'a', 'voted': [{'country': 'b', 'points': '12'}]},
+        {'year': 2000, 'country': 'b', 'voted': [{'country': 'a', 'points': '8'}]},
+    ])
+    assert matrix.top_friends(k=3).shape == (2, 1)
+    assert matrix.blocs(k=3) == [['a', 'b']]
+    assert matrix.mutual_friends(k=3) == [('a', 'b', 20)]
+
+
+def test_single_country_has_no_friends():
+    matrix = _matrix([{'year': 2000, 'country': 'a', 'voted': []}])
+    assert matrix.top_friends(k=3).shape == (1, 0)
+    assert matrix.blocs(k=3) == []
+    assert matrix.mutual_friends(k=1) == []
+    assert np.array_equal(matrix.totals(), np.zeros((1, 1)))
+
+
+def test_documents_are_joined_on_country_ids(registry):
+    registry.add_alias('Country D', registry.lookup('d'))
+    matrix = _matrix([
+        {'year': 2000, 'country_id': registry.lookup('c'), 'voted': [{'country_id': registry.lookup('d'), 'points': '12'}]},
+        {'year': 2000, 'country': 'Country D', 'voted': [{'country': 'c', 'points': '10'}, {'country': 'x', 'points': '8'}]},
+    ])
+    assert matrix.countries == ['c', 'd']
+    assert matrix.mutual_friends(k=1) == [('c', 'd', 22)]
@@ -0,0 +1,54 @@
+import pytest
+
+from EurovisionStat.winning_eurovision_2019 import countries, vote_matrix, vote_store
+from EurovisionStat.winning_eurovision_2019.vote_store import VoteColumns
+
+DOCUMENTS = [
+    {'year': 2000, 'country': 'a', 'voted': [{'country': 'b', 'points': '12'}, {'country': 'c', 'points': '8'}]},
+    {'year': 2001, 'country': 'b', 'voted': [{'country': 'a', 'points': '10'}]},
+]
+
+
+@pytest.fixture
+def saved(tmp_path):
+    registry = countries.CountryRegistry()
+    for name in ('a', 'b', 'c'):
+        registry.register(name)
+    countries.set_registry(registry)
+    VoteColumns.from_documents(DOCUMENTS).save(str(tmp_path))
+    countries.set_registry(None)
+    yield str(tmp_path)
+    countries.set_registry(None)
+
+
+def test_load_does_not_need_a_registry(saved, monkeypatch):
+    def no_registry():
+        raise AssertionError('registry used')
+
+    monkeypatch.setattr(vote_store, 'get_registry', no_registry)
+    monkeypatch.setattr(vote_matrix, 'get_registry', no_registry)
+    matrix = VoteColumns.load(saved).to_matrix()
+    assert matrix.countries == ['a', 'b', 'c']
+    assert matrix.totals()[matrix.index('a'), matrix.index('b')] == 12
+    assert matrix.mutual_friends(k=1) == [('a', 'b', 22)]
+
+
+def test_load_remaps_to_given_registry(saved):
+    registry = countries.CountryRegistry()
+    for name in ('c', 'b', 'a'):
+        registry.register(name)
+    columns = VoteColumns.load(saved, registry=registry)
+    assert columns.names == {registry.lookup(name): name for name in ('a', 'b', 'c')}
+    documents = list(columns.given_from_documents())
+    assert [(doc['year'], doc['country_id'], doc['country']) for doc in documents] == [
+        (2000, registry.lookup('a'), 'a'), (2001, registry.lookup('b'), 'b')
+    ]
+    assert sorted(vote['country_id'] for vote in documents[0]['voted']) == sorted(
+        [registry.lookup('b'), registry.lookup('c')])
+
+
+def test_load_with_registry_missing_a_country_fails(saved):
+    registry = countries.CountryRegistry()
+    registry.register('a')
+    with pytest.raises(countries.UnknownCountryError):
+        VoteColumns.load(saved, registry=registry)
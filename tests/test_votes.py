@@ -0,0 +1,102 @@
+import pytest
+
+from EurovisionStat.winning_eurovision_2019 import countries, http_cache, http_client, page_spool, votes
+from EurovisionStat.winning_eurovision_2019.benchmarks.stub_server import StubServer
+
+YEARS = votes.LAST_YEAR - votes.FIRST_YEAR + 1
+
+
+class ThrottlingStub(StubServer):
+    """
+    Stub server who answers votes requests of the throttled countries with a throttle page
+    """
+    throttled = ()
+
+    def votes_page(self, form):
+        if form['country_x'][0] in self.throttled:
+            return b'<html>too many requests</html>'
+        return super().votes_page(form)
+
+
+@pytest.fixture
+def stub(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(http_cache, 'ENABLED', False)
+    monkeypatch.setattr(http_client, 'MAX_RETRIES', 1)
+    monkeypatch.setattr(http_client, 'BACKOFF_BASE', 0)
+    monkeypatch.setattr(page_spool, 'SPOOL_DIR', str(tmp_path))
+    with ThrottlingStub(countries=3) as stub:
+        monkeypatch.setattr(votes, 'EUROVISION_DB_URL', stub.url)
+        yield stub
+
+
+def _given_from(client):
+    return client.eurovision['points_by_year_given_from']
+
+
+def test_incremental_downloads_only_missing_years(stub, client):
+    stub.throttled = ('c1',)
+    votes.workflow(concurrency=2, parse_workers=1)
+    assert _given_from(client).count_documents({}) == 2 * YEARS
+    # The throttled pages are not stored, their years are downloaded by the rerun
+    assert len(page_spool.list_pages('votes')) == 4
+    stub.throttled = ()
+    sent = stub.requests
+    votes.workflow(concurrency=2, parse_workers=1, incremental=True)
+    # Countries page and both directions of the throttled country
+    assert stub.requests - sent == 3
+    assert _given_from(client).count_documents({}) == 3 * YEARS
+    sent = stub.requests
+    votes.workflow(concurrency=2, parse_workers=1, incremental=True)
+    assert stub.requests - sent == 1
+
+
+def test_reparse_rebuilds_votes_from_spool(stub, client):
+    votes.workflow(concurrency=2, parse_workers=1)
+    stored = list(_given_from(client).find({}, {'_id': 0}).sort([('country_id', 1), ('year', 1)]))
+    _given_from(client).delete_many({})
+    sent = stub.requests
+    votes.reparse(parse_workers=1)
+    assert stub.requests == sent
+    assert list(_given_from(client).find({}, {'_id': 0}).sort([('country_id', 1), ('year', 1)])) == stored
+
+
+def test_reparse_uses_newest_page_of_every_year(stub, client):
+    votes.workflow(concurrency=2, parse_workers=1)
+    # Narrower newer download of one year replaces only that year
+    page_spool.store('votes', ('c0', True, 2000, 2000), b'<html><table id="tabelle1"></table></html>',
+                     meta={'country_name': 'Country 0'})
+    votes.reparse(parse_workers=1)
+    country_id = countries.get_registry().lookup('Country 0')
+    assert _given_from(client).find_one({'country_id': country_id, 'year': 2000})['voted'] == []
+    assert _given_from(client).find_one({'country_id': country_id, 'year': 2001})['voted'] != []
+
+
+def test_iter_votes_sources_agree(stub, client):
+    votes.workflow(concurrency=2, parse_workers=1)
+    for from_country in (True, False):
+        arguments = (['Country 1'], 1990, 1999, from_country)
+        from_db = sorted(votes.iter_votes(*arguments, source='db'))
+        assert from_db
+        assert sorted(votes.iter_votes(*arguments, source='spool')) == from_db
+        assert sorted(votes.iter_votes(*arguments, source='network')) == from_db
+        assert all(1990 <= record.year <= 1999 for record in from_db)
+        assert all((record.voter if from_country else record.recipient) == 'Country 1' for record in from_db)
+
+
+def test_iter_votes_reads_documents_without_country_ids(client):
+    registry = countries.get_registry()
+    registry.register('Israel')
+    registry.register('Spain')
+    _given_from(client).insert_many([
+        {'year': 1990, 'country': 'israel', 'voted': [{'country': 'Spain', 'points': '12'}]},
+        {'year': 1990, 'country_id': registry.lookup('Spain'), 'country': 'Spain',
+         'voted': [{'country_id': registry.lookup('Israel'), 'points': '8'}, {'country': 'Narnia', 'points': '1'}]},
+    ])
+    assert list(votes.iter_votes(['Israel'])) == [(1990, 'Israel', 'Spain', 12)]
+    assert sorted(votes.iter_votes()) == [(1990, 'Israel', 'Spain', 12), (1990, 'Spain', 'Israel', 8),
+                                          (1990, 'Spain', 'Narnia', 1)]
+
+
+def test_iter_votes_unknown_source(client):
+    with pytest.raises(ValueError):
+        list(votes.iter_votes(source='cache'))
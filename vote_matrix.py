@@ -0,0 +1,214 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from EurovisionStat.winning_eurovision_2019.countries import get_registry
+
+LOGGER = logging.getLogger(__name__)
+
+
+def document_country_id(document):
+    # type: (dict) -> int
+    """
+    Get countries registry id of a votes document or of an entry of its voted list.
+    Documents stored before the ids were added are looked up by name
+    :param document: dict with 'country_id' or 'country'
+    :return: country id, None if the country is unknown
+    """
+    country_id = document.get('country_id')
+    if country_id is None and document.get('country'):
+        country_id = get_registry().lookup(document['country'])
+    return country_id
+
+
+class VoteMatrix(object):
+    """
+    Dense year x voter x recipient array of integer points.
+    points[y, i, j] is the points country i gave country j in years[y]
+    """
+
+    def __init__(self, country_ids, years, points, countries=None):
+        # type: (list, np.ndarray, np.ndarray, list) -> None
+        """
+        :param country_ids: countries registry ids, index of an id is its voter/recipient index
+        :param years: sorted years, index of a year is its index in the first points axis
+        :param points: int array shaped (years, countries, countries)
+        :param countries: names of the ids, None -> names of the countries registry
+        """
+        self.country_ids = list(country_ids)
+        if countries is None:
+            registry = get_registry()
+            countries = [registry.name(country_id) for country_id in self.country_ids]
+        self.countries = list(countries)
+        self.years = np.asarray(years)
+        self.points = points
+        self._index = {country_id: i for i, country_id in enumerate(self.country_ids)}
+        self._names = {name: i for i, name in enumerate(self.countries)}
+
+    @classmethod
+    def from_documents(cls, documents):
+        # type: (iter) -> VoteMatrix
+        """
+        Build matrix from points_by_year_given_from documents, votes of unknown countries are skipped
+        :param documents: iterable of {'year', 'country_id', 'voted': [{'country_id', 'points'}]} dicts
+        :return: VoteMatrix object
+        """
+        index = {}
+        votes = []
+        for doc in documents:
+            voter_id = document_country_id(doc)
+            if voter_id is None:
+                continue
+            voter = index.setdefault(voter_id, len(index))
+            for vote in doc.get('voted', []):
+                try:
+                    points = int(vote['points'])
+                except (KeyError, ValueError):
+                    continue
+                recipient_id = document_country_id(vote)
+                if recipient_id is None:
+                    continue
+                recipient = index.setdefault(recipient_id, len(index))
+                votes.append((doc['year'], voter, recipient, points))
+        years = sorted({vote[0] for vote in votes})
+        matrix = np.zeros((len(years), len(index), len(index)), dtype=np.int16)
+        if votes:
+            year_index = {year: i for i, year in enumerate(years)}
+            year, voter, recipient, points = zip(*votes)
+            # Sum, a country may give points to the same country more than once in a year (semi final and final)
+            np.add.at(matrix, ([year_index[y] for y in year], voter, recipient), points)
+        country_ids = sorted(index, key=index.get)
+        LOGGER.info(f"Built vote matrix. years: {len(years)}, countries: {len(country_ids)}, votes: {len(votes)}")
+        return cls(country_ids, years, matrix)
+
+    @classmethod
+    def from_collection(cls, collection):
+        """
+        Build matrix from Mongo points_by_year_given_from collection, in one query
+        :param collection: Mongo collection
+        :return: VoteMatrix object
+        """
+        return cls.from_documents(collection.find({}, {'_id': 0, 'year': 1, 'country': 1, 'country_id': 1, 'voted': 1}))
+
+    def index(self, country):
+        # type: (str or int) -> int
+        """
+        :param country: country id, or any of its names - names not in the matrix are looked up in the registry
+        :return: voter/recipient index of the country
+        :raise: KeyError if the country is not in the matrix
+        """
+        if isinstance(country, int):
+            return self._index[country]
+        if country in self._names:
+            return self._names[country]
+        return self._index[get_registry().lookup(country, strict=True)]
+
+    def totals(self, year_from=None, year_to=None):
+        # type: (int, int) -> np.ndarray
+        """
+        Sum points over years
+        :param year_from: first year, None -> from first year
+        :param year_to: last year, None -> until last year
+        :return: int array shaped (countries, countries), [i, j] -> total points i gave j
+        """
+        mask = np.ones(len(self.years), dtype=bool)
+        if year_from is not None:
+            mask &= self.years >= year_from
+        if year_to is not None:
+            mask &= self.years <= year_to
+        return self.points[mask].sum(axis=0, dtype=np.int32)
+
+    def top_friends(self, k=1, year_from=None, year_to=None):
+        # type: (int, int, int) -> np.ndarray
+        """
+        Get the k countries every country gave the most points to, only countries who got points are friends
+        :param k: number of friends, at most all the other countries
+        :param year_from: first year, None -> from first year
+        :param year_to: last year, None -> until last year
+        :return: int array shaped (countries, k) of recipient indexes, best friend first.
+                 -1 fills the row of a country who gave points to less than k countries
+        """
+        k = min(k, len(self.countries) - 1)
+        if k <= 0:
+            return np.empty((len(self.countries), 0), dtype=np.intp)
+        totals = self.totals(year_from, year_to)
+        np.fill_diagonal(totals, -1)
+        top = np.argpartition(-totals, k - 1, axis=1)[:, :k]
+        top_points = np.take_along_axis(totals, top, axis=1)
+        order = np.argsort(-top_points, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top[np.take_along_axis(top_points, order, axis=1) <= 0] = -1
+        return top
+
+    def _top_mask(self, k, year_from, year_to):
+        # type: (int, int, int) -> np.ndarray
+        top = self.top_friends(k, year_from, year_to)
+        mask = np.zeros((len(self.countries), len(self.countries)), dtype=bool)
+        voter, _ = np.nonzero(top >= 0)
+        mask[voter, top[top >= 0]] = True
+        return mask
+
+    def mutual_friends(self, k=1, year_from=None, year_to=None):
+        # type: (int, int, int) -> list[tuple]
+        """
+        Get pairs of countries who are both in the top k friends of each other
+        :param k: number of friends
+        :param year_from: first year, None -> from first year
+        :param year_to: last year, None -> until last year
+        :return: list of (country, country, points given to each other) tuples, most points first.
+                 Pairs with equal points are all kept
+        """
+        totals = self.totals(year_from, year_to)
+        top = self._top_mask(k, year_from, year_to)
+        mutual = np.triu(top & top.T, 1)
+        first, second = np.nonzero(mutual)
+        scores = totals[first, second] + totals[second, first]
+        order = np.argsort(-scores, kind='stable')
+        return [(self.countries[first[i]], self.countries[second[i]], int(scores[i])) for i in order]
+
+    def reciprocity(self, year_from=None, year_to=None):
+        # type: (int, int) -> np.ndarray
+        """
+        How balanced the points between every two countries are
+        :param year_from: first year, None -> from first year
+        :param year_to: last year, None -> until last year
+        :return: float array shaped (countries, countries), 1 -> gave each other the same points, 0 -> one sided
+        """
+        totals = self.totals(year_from, year_to)
+        high = np.maximum(totals, totals.T)
+        low = np.minimum(totals, totals.T)
+        return np.divide(low, high, out=np.zeros(high.shape), where=high > 0)
+
+    def blocs(self, k=3, year_from=None, year_to=None):
+        # type: (int, int, int) -> list[list]
+        """
+        Detect voting blocs - groups of countries connected by mutual top k friendship
+        :param k: number of friends
+        :param year_from: first year, None -> from first year
+        :param year_to: last year, None -> until last year
+        :return: list of blocs, each bloc is a sorted list of country names. Biggest bloc first
+        """
+        top = self._top_mask(k, year_from, year_to)
+        reach = (top & top.T) | np.eye(len(self.countries), dtype=bool)
+        # Square the reachability matrix until it stops growing -> connected components
+        while True:
+            grown = (reach.astype(np.int32) @ reach.astype(np.int32)) > 0
+            if np.array_equal(grown, reach):
+                break
+            reach = grown
+        groups = {tuple(np.nonzero(row)[0]) for row in reach}
+        blocs = [sorted(self.countries[i] for i in group) for group in groups if len(group) > 1]
+        return sorted(blocs, key=lambda bloc: (-len(bloc), bloc))
+
+    def to_dataframe(self):
+        """
+        Get the non zero votes as long pandas DataFrame
+        :return: DataFrame with year, voter, recipient and points columns
+        """
+        year, voter, recipient = np.nonzero(self.points)
+        return pd.DataFrame({
+            'year': self.years[year],
+            'voter': np.asarray(self.countries)[voter],
+            'recipient': np.asarray(self.countries)[recipient],
+            'points': self.points[year, voter, recipient]
+        })
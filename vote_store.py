@@ -0,0 +1,243 @@
+import json
+import logging
+import os
+
+import numpy as np
+from EurovisionStat.winning_eurovision_2019.countries import get_registry
+from EurovisionStat.winning_eurovision_2019.mongo import BulkWriter
+from EurovisionStat.winning_eurovision_2019.vote_matrix import VoteMatrix, document_country_id
+
+LOGGER = logging.getLogger(__name__)
+
+COLUMNS = ('year', 'voter', 'recipient', 'points')
+COUNTRIES_FILE = 'countries.json'
+
+
+class VoteColumns(object):
+    """
+    Votes as columns - one row per (year, voter, recipient) with countries registry ids and int16 points.
+    Saved as a directory of .npy files, who are memory mapped on load, and the names of the ids
+    """
+
+    def __init__(self, year, voter, recipient, points, names=None):
+        # type: (np.ndarray, np.ndarray, np.ndarray, np.ndarray, dict) -> None
+        """
+        :param year: int16 array of years
+        :param voter: int16 array of voter country ids
+        :param recipient: int16 array of recipient country ids
+        :param points: int16 array of points
+        :param names: country id -> name of every id in the columns, None -> names of the countries registry
+        """
+        self.year = year
+        self.voter = voter
+        self.recipient = recipient
+        self.points = points
+        if names is None:
+            registry = get_registry()
+            names = {country_id: registry.name(country_id) for country_id in self.country_ids().tolist()}
+        self.names = names
+
+    def __len__(self):
+        return len(self.points)
+
+    def country_ids(self):
+        # type: () -> np.ndarray
+        """
+        :return: sorted unique ids of the voters and recipients
+        """
+        return np.unique(np.concatenate([self.voter, self.recipient]))
+
+    @classmethod
+    def _from_rows(cls, rows):
+        # type: (list) -> VoteColumns
+        columns = np.array(rows, dtype=np.int16).reshape(-1, len(COLUMNS))
+        LOGGER.info(f"Built vote columns. rows: {len(rows)}, countries: {len(np.unique(columns[:, 1:3]))}")
+        return cls(*(np.ascontiguousarray(columns[:, i]) for i in range(len(COLUMNS))))
+
+    @classmethod
+    def from_records(cls, records):
+        # type: (iter) -> VoteColumns
+        """
+        Build columns from a stream of votes, e.g. votes.iter_votes, only the columns are kept in memory.
+        Votes of unknown countries are skipped
+        :param records: iterable of (year, voter, recipient, points) tuples, countries as names or registry ids
+        :return: VoteColumns object
+        """
+        registry = get_registry()
+        ids = {}
+
+        def country_id(country):
+            if isinstance(country, int):
+                return country
+            if country not in ids:
+                ids[country] = registry.lookup(country)
+            return ids[country]
+
+        rows = []
+        for year, voter, recipient, points in records:
+            try:
+                points = int(points)
+            except (TypeError, ValueError):
+                continue
+            voter, recipient = country_id(voter), country_id(recipient)
+            if voter is not None and recipient is not None:
+                rows.append((year, voter, recipient, points))
+        return cls._from_rows(rows)
+
+    @classmethod
+    def from_documents(cls, documents):
+        # type: (iter) -> VoteColumns
+        """
+        Build columns from points_by_year_given_from documents, votes of unknown countries are skipped
+        :param documents: iterable of {'year', 'country_id', 'voted': [{'country_id', 'points'}]} dicts
+        :return: VoteColumns object
+        """
+        rows = []
+        for doc in documents:
+            voter = document_country_id(doc)
+            if voter is None:
+                continue
+            for vote in doc.get('voted', []):
+                try:
+                    points = int(vote['points'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                recipient = document_country_id(vote)
+                if recipient is not None:
+                    rows.append((doc['year'], voter, recipient, points))
+        return cls._from_rows(rows)
+
+    @classmethod
+    def from_collection(cls, collection):
+        """
+        Build columns from Mongo points_by_year_given_from collection, in one query
+        :param collection: Mongo collection
+        :return: VoteColumns object
+        """
+        return cls.from_documents(collection.find({}, {'_id': 0, 'year': 1, 'country': 1, 'country_id': 1, 'voted': 1}))
+
+    def save(self, path):
+        # type: (str) -> None
+        """
+        Save columns to directory, one .npy file per column, and the names of the countries ids
+        :param path: directory path
+        :return: None
+        """
+        os.makedirs(path, exist_ok=True)
+        for column in COLUMNS:
+            np.save(os.path.join(path, f'{column}.npy'), getattr(self, column))
+        with open(os.path.join(path, COUNTRIES_FILE), 'w') as countries_file:
+            json.dump({'countries': self.names}, countries_file)
+        LOGGER.info(f"Saved vote columns. path: {path}, rows: {len(self)}")
+
+    @classmethod
+    def load(cls, path, mmap=True, registry=None):
+        # type: (str, bool, CountryRegistry) -> VoteColumns
+        """
+        Load columns saved with save, names are read from the saved countries file - no db is needed.
+        Ids are registry ids of the saving db, given a registry the columns are remapped in memory to its ids
+        :param path: directory path
+        :param mmap: True -> memory map the columns instead of reading them
+        :param registry: countries registry to remap the ids to, None -> keep the saved ids
+        :return: VoteColumns object
+        :raise: UnknownCountryError if a saved country is not in the given registry
+        """
+        with open(os.path.join(path, COUNTRIES_FILE)) as countries_file:
+            names = {int(country_id): name for country_id, name in json.load(countries_file)['countries'].items()}
+        mmap_mode = 'r' if mmap else None
+        year, voter, recipient, points = (
+            np.load(os.path.join(path, f'{column}.npy'), mmap_mode=mmap_mode) for column in COLUMNS
+        )
+        if registry is not None:
+            current = {country_id: registry.lookup(name, strict=True) for country_id, name in names.items()}
+            if any(country_id != new_id for country_id, new_id in current.items()):
+                mapping = np.arange(max(current) + 1, dtype=np.int16)
+                mapping[list(current)] = list(current.values())
+                voter, recipient = mapping[voter], mapping[recipient]
+            names = {current[country_id]: registry.name(current[country_id]) for country_id in names}
+        return cls(year, voter, recipient, points, names)
+
+    def to_matrix(self):
+        # type: () -> VoteMatrix
+        """
+        Build dense year x voter x recipient matrix
+        :return: VoteMatrix object
+        """
+        years, year_index = np.unique(self.year, return_inverse=True)
+        country_ids = self.country_ids()
+        voter, recipient = np.searchsorted(country_ids, self.voter), np.searchsorted(country_ids, self.recipient)
+        points = np.zeros((len(years), len(country_ids), len(country_ids)), dtype=np.int16)
+        np.add.at(points, (year_index, voter, recipient), self.points)
+        country_ids = country_ids.tolist()
+        return VoteMatrix(country_ids, years, points, [self.names[country_id] for country_id in country_ids])
+
+    def given_from_documents(self):
+        # type: () -> iter
+        """
+        Rebuild points_by_year_given_from documents
+        :return: generator of {'year', 'country_id', 'country', 'voted'} dicts
+        """
+        for year, voter, voted in self._group(self.voter, self.recipient):
+            yield {'year': year, 'country_id': voter, 'country': self.names[voter], 'voted': voted}
+
+    def given_to_documents(self):
+        # type: () -> iter
+        """
+        Derive points_by_year_given_to documents from the given from votes, without scraping them again
+        :return: generator of {'year', 'country_id', 'country', 'voted'} dicts
+        """
+        for year, recipient, voted in self._group(self.recipient, self.voter):
+            yield {'year': year, 'country_id': recipient, 'country': self.names[recipient], 'voted': voted}
+
+    def _group(self, owner, other):
+        # type: (np.ndarray, np.ndarray) -> iter
+        """
+        Group rows by (year, owner country)
+        :param owner: country column the documents are about
+        :param other: country column listed in the documents votes
+        :return: generator of (year, owner id, list of {'country_id', 'points'}) tuples
+        """
+        if not len(self):
+            return
+        order = np.lexsort((owner, self.year))
+        year, owner, other, points = self.year[order], owner[order], other[order], self.points[order]
+        starts = np.flatnonzero(np.r_[True, (np.diff(year) != 0) | (np.diff(owner) != 0)])
+        ends = np.r_[starts[1:], len(order)]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            yield int(year[start]), int(owner[start]), [
+                {'country_id': country_id, 'points': str(score)}
+                for country_id, score in zip(other[start:end].tolist(), points[start:end].tolist())
+            ]
+
+
+def export_collection(collection, path):
+    # type: (Collection, str) -> VoteColumns
+    """
+    Export Mongo points_by_year_given_from collection to columns directory
+    :param collection: Mongo collection
+    :param path: directory path
+    :return: exported VoteColumns object
+    """
+    columns = VoteColumns.from_collection(collection)
+    columns.save(path)
+    return columns
+
+
+def import_to_db(client, path):
+    # type: (MongoClient, str) -> None
+    """
+    Import columns directory to points_by_year_given_from and points_by_year_given_to collections.
+    Countries missing in this db are registered, then the ids are remapped to the ids of this db.
+    Documents replace stored documents of the same country id and year
+    :param client: Mongo client
+    :param path: directory path
+    :return: None
+    """
+    registry = get_registry()
+    for name in VoteColumns.load(path).names.values():
+        registry.register(name)
+    columns = VoteColumns.load(path, registry=registry)
+    with BulkWriter(client, 'points_by_year_given_from', upsert_keys=('country_id', 'year')) as writer:
+        writer.add_many(columns.given_from_documents())
+    with BulkWriter(client, 'points_by_year_given_to', upsert_keys=('country_id', 'year')) as writer:
+        writer.add_many(columns.given_to_documents())
@@ -1,29 +1,48 @@
-import requests
-from urllib.request import urlopen
-from bs4 import BeautifulSoup
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from bs4 import SoupStrainer
 import logging
-from pymongo import MongoClient
-from EurovisionStat.winning_eurovision_2019.config import db
+import multiprocessing
+import os
+import requests
+import time
+from EurovisionStat.winning_eurovision_2019 import http_client, metrics, page_spool, parsers, schema
+from EurovisionStat.winning_eurovision_2019.countries import get_registry
+from EurovisionStat.winning_eurovision_2019.mongo import BATCH_SIZE, BulkWriter, get_client, insert_to_db
+from EurovisionStat.winning_eurovision_2019.vote_matrix import VoteMatrix, document_country_id
+from EurovisionStat.winning_eurovision_2019.vote_store import VoteColumns
 from EurovisionStat.winning_eurovision_2019.config.urls import EUROVISION_DB_URL, VOTES_URL, VOTES_FROM, VOTES_TO
 
-client = MongoClient(f'mongodb://{db.USERNAME}:{db.PASSWORD}@{db.HOST}:{db.PORT}/{db.NAMESPACE}')
-
 LOGGER = logging.getLogger(__name__)
 
+FIRST_YEAR = 1956
+LAST_YEAR = 2018
+# Parsed pages waiting to be stored, per parse worker
+PARSE_QUEUE_SIZE = 4
+SOURCES = ('network', 'spool', 'db')
+# Metrics stage of parsing spooled votes pages, timed in the parse workers
+PARSE_STAGE = 'parse_votes_page'
+
+VoteRecord = namedtuple('VoteRecord', ('year', 'voter', 'recipient', 'points'))
+
 
 def create_country_flag_collection():
     # type: ()-> ()
     """
-    Create document where the country is the key & flag's picture is the value
+    Register all eschome countries in the countries registry and create a document per country
+    with the flag's picture: {'_id': country id, 'name', 'flag'}
     :return: Nothing
     """
     countries = get_all_countries()
-    country_flag = {}
-    for country in countries:
-        country_flag[countries[country]] = 'https://eschome.net/flags/' + country + '.png'
-    insert_to_db(client, country_flag, 'country_flag')
+    country_flag = [
+        {'_id': get_registry().by_code(country), 'name': countries[country],
+         'flag': 'https://eschome.net/flags/' + country + '.png'}
+        for country in countries
+    ]
+    insert_to_db(get_client(), country_flag, 'country_flag', upsert_keys=('_id',))
 
 
+@metrics.timed()
 def get_all_countries():
     # type: () -> dict
     """
@@ -31,27 +50,28 @@ def get_all_countries():
     :return: key: value pairs --> 2 first letters in country name : full country name
     """
     LOGGER.info("Get all countries from countries list")
-    bs = BeautifulSoup(urlopen(EUROVISION_DB_URL).read(), 'html.parser')
+    countries_select = SoupStrainer('select', attrs={'id': 'nosubmit', 'name': 'country_x'})
+    bs = parsers.make_soup(http_client.get(EUROVISION_DB_URL), parse_only=countries_select)
     countries_container = bs.find('select', {'id': 'nosubmit', 'name': 'country_x'}).find_all('option')
     country_list = {}
+    registry = get_registry()
     for _country in countries_container:
         country_list[_country['value']] = _country.text
+        # eschome list is the authoritative one, every other name must be one of its countries or their aliases
+        registry.register(_country.text, code=_country['value'])
     return country_list
 
 
-def get_all_votes(country, from_country=False, year_from=1957, year_to=2018):
-    # type: (str, bool, int, int) -> list[dict]
+def fetch_votes_page(country, from_country=False, year_from=1957, year_to=2018):
+    # type: (str, bool, int, int) -> bytes
     """
-    Get all votes from country or to country.
-    for example:
-    for country = Israel:
-        get all votes from Israel to other countries (from = True)
-        get all voter to Israel from other countries (from = False)
-    :param year_from: From which year get result
-    :param year_to: To which year get result
+    Download votes page from country or to country
     :param country: country to check votes on
     :param from_country: True -> votes FROM this country, False -> votes TO this country
-    :return:list of {country: votes} pairs (dict)
+    :param year_from: From which year get result
+    :param year_to: To which year get result
+    :return: raw html page
+    :raise: requests.RequestException if the page still fails or has no votes table after all retries
     """
     direction = 0
     if from_country:
@@ -69,18 +89,39 @@ def get_all_votes(country, from_country=False, year_from=1957, year_to=2018):
         'y': 7
     }
     headers = {'content-type': 'application/x-www-form-urlencoded'}
-    result = requests.post(f'{EUROVISION_DB_URL}{VOTES_URL}', data=payload, headers=headers)
-    bs = BeautifulSoup(result.text, 'html.parser')
-    table = bs.find("table", {"id": "tabelle1"})
-    rows = table.find_all("tr")
+    # Throttled responses come without the votes table, they are retried and never cached
+    return http_client.post(f'{EUROVISION_DB_URL}{VOTES_URL}', data=payload, headers=headers,
+                            is_valid=lambda content: b'tabelle1' in content)
+
+
+def parse_votes_page(content, by_year=False):
+    # type: (bytes, bool) -> list[dict] or dict
+    """
+    Parse votes page
+    :param content: raw html page from fetch_votes_page
+    :param by_year: True -> keep the year column and split the votes by year
+    :return: list of {country: votes} pairs (dict),
+            or dict of year: list of {country: votes} pairs when by_year is True.
+            None if the page has no votes table
+    """
+    rows = parsers.table_rows(content, 'tabelle1')
+    if rows is None:
+        return None
     all_votes = []
-    for row in rows:
+    votes_by_year = {}
+    for td in rows:
         try:
             votes = {
-                'country': row.find_all('td')[1].text.replace(' ', ''),
-                'points': row.find_all('td')[2].text.replace(' ', '')
+                'country': td[1].replace(' ', ''),
+                'points': td[2].replace(' ', '')
             }
-            all_votes.append(votes)
+            if by_year:
+                year = int(td[0].strip())
+                votes_by_year.setdefault(year, []).append(votes)
+            else:
+                all_votes.append(votes)
+        except ValueError:
+            pass
         except AttributeError:
             pass
         except KeyError:
@@ -91,92 +132,440 @@ def get_all_votes(country, from_country=False, year_from=1957, year_to=2018):
             pass
         except Exception as e:
             print(e)
+    if by_year:
+        return votes_by_year
     return all_votes
 
 
-def insert_to_db(client, documents, collection_name):
+@metrics.timed()
+def get_all_votes(country, from_country=False, year_from=1957, year_to=2018, by_year=False):
+    # type: (str, bool, int, int, bool) -> list[dict] or dict
     """
-    Insert document or list of document (dict or JSON) to db
-    :param client: Mongo client
-    :param collection_name: collection to store the documens
-    :param documents: dict or list of dicts who represent wikipedia table
-    :return: None
-    :raise: TypeError if documents not in correct type (dict or list)
+    Get all votes from country or to country.
+    for example:
+    for country = Israel:
+        get all votes from Israel to other countries (from = True)
+        get all voter to Israel from other countries (from = False)
+    :param year_from: From which year get result
+    :param year_to: To which year get result
+    :param country: country to check votes on
+    :param from_country: True -> votes FROM this country, False -> votes TO this country
+    :param by_year: True -> keep the year column and split the votes by year
+    :return:list of {country: votes} pairs (dict),
+            or dict of year: list of {country: votes} pairs when by_year is True
+    :raise: requests.RequestException if the page can't be downloaded, see fetch_votes_page
     """
-    eurovision_db = client.eurovision
-    if type(documents) is dict:
-        documents = [documents]
-    if type(documents) is list:
-        for doc in documents:
-            LOGGER.info(f"Insert new document to collection {collection_name}")
-            collection = eurovision_db[collection_name]
-            collection.insert_one(doc)
-    else:
-        raise TypeError
+    votes = parse_votes_page(fetch_votes_page(country, from_country, year_from, year_to), by_year=by_year)
+    if votes is None:
+        LOGGER.warning(f"Votes table is missing. country: {country}, years: {year_from}-{year_to}")
+        return {} if by_year else []
+    return votes
+
+
+def _fetch_job(job):
+    # type: (tuple) -> str
+    """
+    Fetch stage worker - download votes page of single country over range of years and spool it to disk
+    :param job: (country code, country name, year from, year to, from_country) tuple
+    :return: spooled page path, None if the page could not be downloaded
+    """
+    country, country_name, year_from, year_to, from_country = job
+    try:
+        content = fetch_votes_page(country, from_country=from_country, year_from=year_from, year_to=year_to)
+    except requests.RequestException as e:
+        # Nothing is stored for the job, so an incremental rerun downloads its years again
+        LOGGER.error(f"Can't download votes page. country: {country_name}, years: {year_from}-{year_to}, error: {e!r}")
+        return None
+    return page_spool.store('votes', (country, from_country, year_from, year_to), content,
+                            meta={'country_name': country_name})
+
+
+def _parse_spooled_page(path):
+    # type: (str) -> tuple
+    """
+    Parse stage worker, runs in a worker process - parse spooled votes page.
+    Metrics recorded in a worker process stay there, so the parse time is returned to be recorded by _parsed_page
+    :param path: spooled page path
+    :return: (parsed, seconds) pair. parsed is (country name, year from, year to, from_country, votes) tuple,
+             votes is a dict: key: year, value: list of (country, points) tuples.
+             parsed is None if the page has no votes table
+    """
+    started = time.perf_counter()
+    (country, from_country, year_from, year_to), meta, content = page_spool.load(path)
+    votes_by_year = parse_votes_page(content, by_year=True)
+    if votes_by_year is None:
+        LOGGER.warning(f"Votes table is missing. country: {country}, years: {year_from}-{year_to}")
+        return None, time.perf_counter() - started
+    # Tuples pickle smaller than dicts on the way back to the main process
+    votes = {year: [(vote['country'], vote['points']) for vote in year_votes]
+             for year, year_votes in votes_by_year.items()}
+    return (meta['country_name'], year_from, year_to, bool(from_country), votes), time.perf_counter() - started
+
+
+def _parsed_page(result):
+    # type: (tuple) -> tuple
+    """
+    Record parse time of a spooled page in this process metrics
+    :param result: (parsed, seconds) pair from _parse_spooled_page
+    :return: parsed page tuple, None if the page has no votes table
+    """
+    parsed, seconds = result
+    metrics.observe(PARSE_STAGE, seconds)
+    return parsed
+
+
+def _votes_documents(parsed, years=None):
+    # type: (tuple, set) -> list[dict]
+    """
+    Build votes documents of a parsed page
+    :param parsed: parsed page tuple from _parse_spooled_page
+    :param years: years to build, None -> all the years of the page
+    :return: list of votes documents in points_by_year_given_from/to format, one per year:
+             {'year', 'country_id', 'country': display name, 'voted': [{'country_id', 'points'}]}
+    :raise: countries.UnknownCountryError if the page country is not registered
+    """
+    country_name, year_from, year_to, _, votes = parsed
+    registry = get_registry()
+    country_id = registry.lookup(country_name, strict=True)
+    name = registry.name(country_id)
+    voted = {}
+    for year in range(year_from, year_to + 1):
+        voted[year] = []
+        for country, points in votes.get(year, []):
+            vote_country_id = registry.lookup(country)
+            # Unknown countries keep their name, so nothing is lost until they get an alias
+            voted[year].append({'country_id': vote_country_id, 'points': points} if vote_country_id is not None
+                               else {'country': country, 'points': points})
+    return [
+        {'year': year, 'country_id': country_id, 'country': name, 'voted': voted[year]}
+        for year in range(year_from, year_to + 1)
+        if years is None or year in years
+    ]
+
 
+def _current_pages(delete_superseded=True):
+    # type: (bool) -> list[tuple]
+    """
+    Find the spooled votes page who is the newest of every country, direction and year.
+    A refetch of some years spools a new page next to the older page who covers them too,
+    pages who are not the newest of any year are superseded
+    :param delete_superseded: True -> delete superseded pages from the spool
+    :return: list of (path, job list, meta dict, set of years the page is the newest of) tuples, spool order
+    """
+    pages = []
+    newest = {}
+    for path in page_spool.list_pages('votes'):
+        job, meta = page_spool.load_header(path)
+        country, from_country, year_from, year_to = job
+        modified = os.stat(path).st_mtime_ns
+        pages.append((path, job, meta))
+        for year in range(year_from, year_to + 1):
+            key = (country, bool(from_country), year)
+            if key not in newest or modified >= newest[key][0]:
+                newest[key] = (modified, path)
+    years = {}
+    for (_, _, year), (_, path) in newest.items():
+        years.setdefault(path, set()).add(year)
+    current = []
+    for path, job, meta in pages:
+        if path in years:
+            current.append((path, job, meta, years[path]))
+        elif delete_superseded:
+            LOGGER.info(f"Delete superseded votes page. path: {path}")
+            os.remove(path)
+    return current
+
+
+def _parse_pool(parse_workers):
+    # type: (int) -> ProcessPoolExecutor
+    # spawn, forking the multi threaded workflow process may copy held locks to the children
+    return ProcessPoolExecutor(
+        max_workers=parse_workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=parsers.set_backend, initargs=(parsers.BACKEND,)
+    )
+
+
+def _split_years(years, years_per_request):
+    # type: (list, int) -> list[tuple]
+    """
+    Split years to (year from, year to) chunks of consecutive years
+    :param years: sorted list of years
+    :param years_per_request: max chunk size, None for no limit
+    :return: list of (year from, year to) pairs
+    """
+    chunks = []
+    for year in years:
+        if chunks and year == chunks[-1][1] + 1 and (
+                not years_per_request or year - chunks[-1][0] < years_per_request):
+            chunks[-1] = (chunks[-1][0], year)
+        else:
+            chunks.append((year, year))
+    return chunks
+
+
+def get_stored_years(collection_name):
+    # type: (str) -> dict
+    """
+    Get years who are already stored for every country. Documents marked with 'stale': True are not counted
+    :param collection_name: points_by_year_given_from or points_by_year_given_to
+    :return: dict: key: country id, value: set of stored years
+    """
+    stored = {}
+    documents = get_client().eurovision[collection_name].find({'stale': {'$ne': True}},
+                                                              {'_id': 0, 'country': 1, 'country_id': 1, 'year': 1})
+    for doc in documents:
+        stored.setdefault(document_country_id(doc), set()).add(doc['year'])
+    return stored
 
-def workflow():
-    LOGGER.info(f"Start downloading votes statistics from url: {EUROVISION_DB_URL}")
+
+def workflow(concurrency=1, max_requests_per_second=None, years_per_request=None, batch_size=BATCH_SIZE,
+             derive_given_to=False, incremental=False, last_year=LAST_YEAR, flush_interval=None, parse_workers=None):
+    # type: (int, float, int, int, bool, bool, int, float, int) -> None
+    """
+    Download votes from/to every country over all years and store them in db
+    :param concurrency: number of votes pages downloaded at the same time
+    :param max_requests_per_second: max requests per second sent to eurovision db, None for no limit
+    :param years_per_request: years covered by a single votes request, None for all years in one request
+    :param batch_size: number of documents written to db in one bulk write
+    :param derive_given_to: True -> download only votes from every country and build the votes to every country
+                            from them, half the requests of downloading both directions
+    :param incremental: True -> download only country years who are not stored yet or marked stale.
+                        Documents are stored in jobs order, so rerun after a crash resumes where it stopped
+    :param last_year: last contest year to download
+    :param flush_interval: max seconds documents wait before written to db, None -> write every batch_size documents
+    :param parse_workers: number of processes parsing the downloaded pages, None -> number of cores.
+                          Raw pages are kept in page_spool, reparse parses them again without downloading
+    :return: None
+    """
+    LOGGER.info(f"Start downloading votes statistics from url: {EUROVISION_DB_URL}. concurrency: {concurrency}")
+    http_client.set_pool_size(max(concurrency, http_client.POOL_SIZE))
+    http_client.set_rate_limit(EUROVISION_DB_URL, max_requests_per_second)
     countries = get_all_countries()
+    registry = get_registry()
+    # Countries are registered now, so old documents bootstrap could not match get their ids before years are counted
+    schema.migrate_country_ids(get_client().eurovision, registry)
+    directions = (True,) if derive_given_to else (True, False)
+    all_years = list(range(FIRST_YEAR, last_year + 1))
+    stored = {True: {}, False: {}}
+    if incremental:
+        stored[True] = get_stored_years('points_by_year_given_from')
+        if not derive_given_to:
+            stored[False] = get_stored_years('points_by_year_given_to')
 
     # For each country get all country that she votes for (direction - to: 0, from: 1)
-    all_points_given_from = []
-    for country in countries:
-        for year in range(1956, 2019):
-            points_year_from = {
-                'year': year,
-                'country': countries[country].lower(),
-                'voted': get_all_votes(country, from_country=True, year_from=year, year_to=year)
-            }
-            all_points_given_from.append(points_year_from)
+    # and all country who votes for her
+    jobs = [
+        (country, countries[country], year_from, year_to, from_country)
+        for from_country in directions
+        for country in countries
+        for year_from, year_to in _split_years(
+            [year for year in all_years if year not in stored[from_country].get(registry.by_code(country), ())],
+            years_per_request
+        )
+    ]
+    LOGGER.info(f"Votes requests to send: {len(jobs)}")
+    # Only the years are kept, the documents are streamed to the writers
+    fetched_years = set()
+    # Collection is per direction, so (country id, year) identify a document. Rerun replaces it instead of duplicate
+    writer_from = BulkWriter(get_client(), 'points_by_year_given_from', batch_size=batch_size,
+                             flush_interval=flush_interval, upsert_keys=('country_id', 'year'))
+    writer_to = BulkWriter(get_client(), 'points_by_year_given_to', batch_size=batch_size,
+                           flush_interval=flush_interval, upsert_keys=('country_id', 'year'))
+    # Fetch threads spool raw pages to disk, parse processes read them, documents are stored in jobs order
+    parse_workers = parse_workers or os.cpu_count()
+    with writer_from, writer_to, ThreadPoolExecutor(max_workers=concurrency) as fetch_executor, \
+            _parse_pool(parse_workers) as parse_executor:
+        max_pending = parse_workers * PARSE_QUEUE_SIZE
+        pending = deque()
+
+        def store_parsed(path, future):
+            parsed = _parsed_page(future.result())
+            if parsed is None:
+                # Years of a page without votes table are not stored, so an incremental rerun downloads them again
+                os.remove(path)
+                return
+            fetched_years.update(range(parsed[1], parsed[2] + 1))
             # Store data to mongodb collection
-            insert_to_db(client, points_year_from, 'points_by_year_given_from')
-
-    # For each country get all country who votes for her
-    all_points_given_to = []
-    for country in countries:
-        for year in range(1956, 2019):
-            points_year_to = {
-                    'year': year,
-                    'country': countries[country].lower(),
-                    'voted': get_all_votes(country, from_country=False, year_from=year, year_to=year)
-                }
-            all_points_given_to.append(points_year_to)
-            insert_to_db(client, points_year_to, 'points_by_year_given_to')
-
-
-def calc_best_friends():
-    """
-    Calculate top best friend - top 3 pairs of countries that voted the most to each other over years
-    :return:
-    """
-    total_countries_votes = client.eurovision['all_points_given_from'].find()
-    countries_sorted_value = {}
-    bff = []
-    for country in total_countries_votes:
-        countries_sorted_value[country['country']] = sorted(country['voted_to'], key=lambda k: int(k['points']), reverse=True)[:4]
-    for country in countries_sorted_value:
-        try:
-            country_given_to = countries_sorted_value[country][0]['country']
-            country_given_from = countries_sorted_value[countries_sorted_value[country][0]['country']][0]['country']
-            if country_given_from == country:
-                if (country_given_to, country) not in bff:
-                    bff.append((country, country_given_to))
-        except KeyError:
-            pass
-    if len(bff) > 3:
-        bff_by_score = {}
-        for pair in bff:
-            bff_by_score[int(countries_sorted_value[pair[0]][0]['points']) + int(countries_sorted_value[pair[1]][0]['points'])] = pair
-        bff_by_score = sorted(bff_by_score.items(), key=lambda k: k, reverse=True)[:3]
-        top_bff = [x[1] for x in bff_by_score]
-        top_bff_json = {
-            '1': [top_bff[0][0], top_bff[0][1]],
-            '2': [top_bff[1][0], top_bff[1][1]],
-            '3': [top_bff[2][0], top_bff[2][1]]
-        }
-        insert_to_db(client, top_bff_json, 'bff')
-        print(top_bff)
+            (writer_from if parsed[3] else writer_to).add_many(_votes_documents(parsed))
+
+        # map keeps jobs order, so documents are stored in the same order as the serial run
+        for path in fetch_executor.map(_fetch_job, jobs):
+            if path is None:
+                continue
+            pending.append((path, parse_executor.submit(_parse_spooled_page, path)))
+            while pending and (pending[0][1].done() or len(pending) > max_pending):
+                store_parsed(*pending.popleft())
+        while pending:
+            store_parsed(*pending.popleft())
+        if derive_given_to:
+            # Votes to a country in a year come from all the countries, derive from all stored votes of these years
+            writer_from.flush()
+            years = sorted(fetched_years)
+            given_from = get_client().eurovision['points_by_year_given_from'].find({'year': {'$in': years}})
+            writer_to.add_many(VoteColumns.from_documents(given_from).given_to_documents())
+
+
+def _document_name(document):
+    # type: (dict) -> str
+    """
+    Get registered name of the country of a votes document or voted entry, the stored name if it is unknown
+    :param document: dict with 'country_id' or 'country'
+    :return: country name
+    """
+    country_id = document_country_id(document)
+    return document.get('country') if country_id is None else get_registry().name(country_id)
+
+
+def _canonical_votes(votes_by_year):
+    # type: (dict) -> dict
+    """
+    Replace the country names of parsed votes with their registered names, pages write them without spaces
+    :param votes_by_year: dict: key: year, value: list of (country, points) pairs
+    :return: dict: key: year, value: list of (registered country name, points) pairs
+    """
+    registry = get_registry()
+    names = {}
+    canonical = {}
+    for year, votes in votes_by_year.items():
+        canonical[year] = []
+        for country, points in votes:
+            if country not in names:
+                names[country] = registry.canonical_name(country)
+            canonical[year].append((names[country], points))
+    return canonical
+
+
+def _page_records(country_name, from_country, votes_by_year, year_from, year_to, years=None):
+    # type: (str, bool, dict, int, int, set) -> iter
+    """
+    Turn votes of one page or document to records
+    :param country_name: country the votes are from or to
+    :param from_country: True -> votes from country_name, False -> votes to country_name
+    :param votes_by_year: dict: key: year, value: list of (country, points) pairs
+    :param year_from: skip years before it
+    :param year_to: skip years after it
+    :param years: skip years who are not in it, None -> no skip
+    :return: generator of VoteRecord
+    """
+    for year in sorted(votes_by_year):
+        if not year_from <= year <= year_to or (years is not None and year not in years):
+            continue
+        for country, points in votes_by_year[year]:
+            try:
+                points = int(points)
+            except (TypeError, ValueError):
+                continue
+            if from_country:
+                yield VoteRecord(year, country_name, country, points)
+            else:
+                yield VoteRecord(year, country, country_name, points)
+
+
+def iter_votes(countries=None, year_from=FIRST_YEAR, year_to=LAST_YEAR, from_country=True, source='db'):
+    # type: (iter, int, int, bool, str) -> iter
+    """
+    Stream votes as (year, voter, recipient, points) records, one page or document is in memory at a time.
+    Countries are the registered names of every source, so records of all sources can be grouped as they are.
+    for example, all points Israel gave in the 90s:
+        for year, voter, recipient, points in iter_votes(['Israel'], 1990, 1999):
+    :param countries: names (any alias) or ids of the countries whose votes are wanted, None -> all countries
+    :param year_from: first year
+    :param year_to: last year
+    :param from_country: True -> votes given by the countries, False -> votes given to the countries
+    :param source: 'network' -> download the votes pages (responses in http_cache are not downloaded again),
+                   'spool' -> raw pages kept by workflow, every year is read from its newest page,
+                   'db' -> stored votes documents
+    :return: generator of VoteRecord named tuples
+    :raise: ValueError if source is unknown
+    """
+    registry = get_registry()
+    wanted = None if countries is None else {
+        country if isinstance(country, int) else registry.lookup(country) for country in countries
+    } - {None}
+    if source == 'network':
+        for code, name in get_all_countries().items():
+            if wanted is None or registry.by_code(code) in wanted:
+                votes_by_year = get_all_votes(code, from_country=from_country, year_from=year_from, year_to=year_to,
+                                              by_year=True)
+                yield from _page_records(
+                    registry.canonical_name(name), from_country,
+                    _canonical_votes({year: [(vote['country'], vote['points']) for vote in votes]
+                                      for year, votes in votes_by_year.items()}),
+                    year_from, year_to
+                )
+    elif source == 'spool':
+        for path, (_, page_from_country, _, _), meta, years in _current_pages(delete_superseded=False):
+            name = meta['country_name']
+            if bool(page_from_country) != from_country or max(years) < year_from or min(years) > year_to or (
+                    wanted is not None and registry.lookup(name) not in wanted):
+                continue
+            parsed = _parsed_page(_parse_spooled_page(path))
+            if parsed is None:
+                continue
+            name, _, _, _, votes = parsed
+            yield from _page_records(registry.canonical_name(name), from_country, _canonical_votes(votes),
+                                     year_from, year_to, years)
+    elif source == 'db':
+        collection_name = 'points_by_year_given_from' if from_country else 'points_by_year_given_to'
+        query = {'year': {'$gte': year_from, '$lte': year_to}}
+        if wanted is not None:
+            # Documents stored before the ids were added are matched by name below
+            query['$or'] = [{'country_id': {'$in': list(wanted)}}, {'country_id': {'$exists': False}}]
+        documents = get_client().eurovision[collection_name].find(
+            query, {'_id': 0, 'year': 1, 'country': 1, 'country_id': 1, 'voted': 1}
+        )
+        for doc in documents:
+            country_id = document_country_id(doc)
+            if wanted is not None and country_id not in wanted:
+                continue
+            votes = [(_document_name(vote), vote.get('points')) for vote in doc.get('voted', [])]
+            yield from _page_records(_document_name(doc), from_country, {doc['year']: votes}, year_from, year_to)
     else:
-        print(bff)
+        raise ValueError(f"Unknown votes source: {source}, expected one of {SOURCES}")
+
+
+def reparse(batch_size=BATCH_SIZE, parse_workers=None):
+    # type: (int, int) -> None
+    """
+    Parse all spooled votes pages again and replace the stored votes documents, nothing is downloaded.
+    Run after changing parse_votes_page, pages are parsed in batches by all cores.
+    Every year is built from the newest page who covers it
+    :param batch_size: number of documents written to db in one bulk write
+    :param parse_workers: number of parsing processes, None -> number of cores
+    :return: None
+    """
+    pages = _current_pages()
+    paths = [page[0] for page in pages]
+    parse_workers = parse_workers or os.cpu_count()
+    LOGGER.info(f"Reparse spooled votes pages. pages: {len(paths)}, parse workers: {parse_workers}")
+    writers = {
+        True: BulkWriter(get_client(), 'points_by_year_given_from', batch_size=batch_size, upsert_keys=('country_id', 'year')),
+        False: BulkWriter(get_client(), 'points_by_year_given_to', batch_size=batch_size, upsert_keys=('country_id', 'year'))
+    }
+    chunk_size = max(1, len(paths) // (parse_workers * PARSE_QUEUE_SIZE))
+    with writers[True], writers[False], _parse_pool(parse_workers) as parse_executor:
+        parsed_pages = parse_executor.map(_parse_spooled_page, paths, chunksize=chunk_size)
+        for result, (_, _, _, years) in zip(parsed_pages, pages):
+            parsed = _parsed_page(result)
+            if parsed is not None:
+                writers[parsed[3]].add_many(_votes_documents(parsed, years))
 
+
+@metrics.timed()
+def calc_best_friends(year_from=None, year_to=None):
+    # type: (int, int) -> list[tuple]
+    """
+    Calculate top best friend - top 3 pairs of countries that voted the most to each other over years.
+    Best friends are countries who gave each other the most points, pairs are ranked by the points they exchanged
+    :param year_from: first year, None -> from first year
+    :param year_to: last year, None -> until last year
+    :return: list of up to 3 (country, country) pairs
+    """
+    matrix = VoteMatrix.from_collection(get_client().eurovision['points_by_year_given_from'])
+    bff = [(first, second) for first, second, _ in matrix.mutual_friends(k=1, year_from=year_from, year_to=year_to)]
+    top_bff = bff[:3]
+    if len(top_bff) == 3:
+        top_bff_json = {str(place): list(pair) for place, pair in enumerate(top_bff, start=1)}
+        insert_to_db(get_client(), top_bff_json, 'bff')
+    print(top_bff)
+    return top_bff